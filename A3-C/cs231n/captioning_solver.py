@@ -4,7 +4,7 @@ from builtins import object
 import numpy as np
 
 from cs231n import optim
-from cs231n.coco_utils import sample_coco_minibatch
+from cs231n.data_iter import BatchIterator
 
 
 class CaptioningSolver(object):
@@ -43,6 +43,10 @@ class CaptioningSolver(object):
                     print_every=100)
     solver.train()
 
+    With load_coco_data(lazy=True) the features are read from the HDF5 files
+    as the minibatches need them; the solver does not own the files, so call
+    close_coco_data(data) once done with the data.
+
 
     A CaptioningSolver works on a model object that must conform to the following
     API:
@@ -70,7 +74,8 @@ class CaptioningSolver(object):
 
         Required arguments:
         - model: A model object conforming to the API described above
-        - data: A dictionary of training and validation data from load_coco_data
+        - data: A dictionary of training and validation data from load_coco_data,
+          which may have been loaded with lazy=True
 
         Optional arguments:
         - update_rule: A string giving the name of an update rule in optim.py.
@@ -88,6 +93,9 @@ class CaptioningSolver(object):
           iterations.
         - verbose: Boolean; if set to false then no output will be printed during
           training.
+        - shuffle: How minibatches of captions are sampled; one of 'epoch'
+          (default), 'once', 'replacement' or 'none', see
+          data_iter.BatchIterator.
         """
         self.model = model
         self.data = data
@@ -101,6 +109,7 @@ class CaptioningSolver(object):
 
         self.print_every = kwargs.pop('print_every', 10)
         self.verbose = kwargs.pop('verbose', True)
+        self.shuffle = kwargs.pop('shuffle', 'epoch')
 
         # Throw an error if there are extra keyword arguments
         if len(kwargs) > 0:
@@ -127,6 +136,9 @@ class CaptioningSolver(object):
         self.loss_history = []
         self.train_acc_history = []
         self.val_acc_history = []
+        self.batches = BatchIterator((self.data['train_captions'],
+                                      self.data['train_image_idxs']),
+                                     self.batch_size, shuffle=self.shuffle)
 
         # Make a deep copy of the optim_config for each parameter
         self.optim_configs = {}
@@ -140,10 +152,8 @@ class CaptioningSolver(object):
         be called manually.
         """
         # Make a minibatch of training data
-        minibatch = sample_coco_minibatch(self.data,
-                                          batch_size=self.batch_size,
-                                          split='train')
-        captions, features, urls = minibatch
+        captions, image_idxs = self.batches.next_batch()
+        features = self.data['train_features'][image_idxs]
 
         # Compute loss and gradient
         loss, grads = self.model.loss(features, captions)
@@ -203,8 +213,7 @@ class CaptioningSolver(object):
         """
         Run optimization to train the model.
         """
-        num_train = self.data['train_captions'].shape[0]
-        iterations_per_epoch = max(num_train // self.batch_size, 1)
+        iterations_per_epoch = max(len(self.batches), 1)
         num_iterations = self.num_epochs * iterations_per_epoch
 
         for t in range(num_iterations):
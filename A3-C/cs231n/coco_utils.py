@@ -1,4 +1,5 @@
 from builtins import range
+from collections import OrderedDict
 import os, json
 import numpy as np
 import h5py
@@ -6,9 +7,126 @@ import h5py
 BASE_DIR = 'cs231n/datasets/coco_captioning'
 
 
+class H5Rows(object):
+    """
+    Read-only view of an HDF5 dataset that reads rows on demand.
+
+    Indexing with an integer, a slice or an array of row indices returns a
+    numpy array, just like indexing the array load_coco_data used to return,
+    but only the rows asked for are read from disk. Array indices are
+    deduplicated and sorted before the read, since HDF5 reads increasing
+    selections fastest (and h5py accepts no others), and the rows are then
+    put back in the requested order.
+
+    Rows can also be read in blocks of block_size consecutive rows, of which
+    the cache_blocks most recently used are kept in memory; this pays off
+    when the same images are sampled again and again, as with max_train.
+
+    The HDF5 file stays open until close() is called, or until the end of
+    a with block over the H5Rows. h5py file handles do not survive a fork,
+    so worker processes should open their own.
+    """
+
+    def __init__(self, filename, key, cache_blocks=0, block_size=256):
+        """
+        Inputs:
+        - filename: Path of the HDF5 file
+        - key: Name of the dataset in the file
+        - cache_blocks: Number of blocks of rows to keep in memory; 0 reads
+          exactly the rows requested and caches nothing
+        - block_size: Number of rows per block
+        """
+        self.file = h5py.File(filename, 'r')
+        self.dataset = self.file[key]
+        self.shape = self.dataset.shape
+        self.dtype = self.dataset.dtype
+        self.ndim = len(self.shape)
+        self.cache_blocks = cache_blocks
+        self.block_size = block_size
+        self._cache = OrderedDict()
+
+    def __len__(self):
+        return self.shape[0]
+
+    def __array__(self, dtype=None, copy=None):
+        return np.asarray(self[:], dtype=dtype)
+
+    def __getitem__(self, index):
+        if isinstance(index, (int, np.integer)):
+            return self[np.array([index])][0]
+        if (isinstance(index, slice) and not self.cache_blocks
+                and index.step in (None, 1)):
+            return self.dataset[index]
+        if isinstance(index, slice):
+            index = np.arange(*index.indices(self.shape[0]))
+        index = np.asarray(index)
+        if index.dtype == bool:
+            index = np.flatnonzero(index)
+        index = np.where(index < 0, index + self.shape[0], index)
+        rows, inverse = np.unique(index.ravel(), return_inverse=True)
+        out = self._read(rows)
+        return out[inverse].reshape(index.shape + self.shape[1:])
+
+    def _read(self, rows):
+        """ Read the sorted, distinct rows into a new array. """
+        out = np.empty((len(rows),) + self.shape[1:], dtype=self.dtype)
+        if len(rows) == 0:
+            return out
+        if not self.cache_blocks:
+            if rows[-1] - rows[0] + 1 == len(rows):
+                # Contiguous, so one slice read does
+                self.dataset.read_direct(
+                    out, np.s_[int(rows[0]):int(rows[-1]) + 1])
+            else:
+                out[...] = self.dataset[rows]
+            return out
+        blocks = rows // self.block_size
+        for b in np.unique(blocks):
+            mask = blocks == b
+            out[mask] = self._block(int(b))[rows[mask] - b * self.block_size]
+        return out
+
+    def _block(self, b):
+        """ Returns block b of the rows, from the cache if it is there. """
+        if b in self._cache:
+            self._cache.move_to_end(b)
+            return self._cache[b]
+        start = b * self.block_size
+        block = self.dataset[start:min(start + self.block_size, self.shape[0])]
+        self._cache[b] = block
+        if len(self._cache) > self.cache_blocks:
+            self._cache.popitem(last=False)
+        return block
+
+    def close(self):
+        """ Drop the cache and close the HDF5 file. """
+        self._cache.clear()
+        self.file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+
 def load_coco_data(base_dir=BASE_DIR,
                    max_train=None,
-                   pca_features=True):
+                   pca_features=True,
+                   lazy=False,
+                   cache_blocks=0,
+                   block_size=256):
+    """
+    Load the COCO captioning data.
+
+    With lazy=True the image features, which make up nearly all of the data,
+    are H5Rows over the open HDF5 files instead of arrays, so loading takes
+    no time or memory whatever the size of the features and minibatches read
+    only the rows they use; cache_blocks and block_size are passed on to
+    H5Rows. The captions, vocabulary and URLs are loaded into memory either
+    way. Pass the result to close_coco_data once done with it to close the
+    files.
+    """
     data = {}
     caption_file = os.path.join(base_dir, 'coco2014_captions.h5')
     with h5py.File(caption_file, 'r') as f:
@@ -19,15 +137,25 @@ def load_coco_data(base_dir=BASE_DIR,
         train_feat_file = os.path.join(base_dir, 'train2014_vgg16_fc7_pca.h5')
     else:
         train_feat_file = os.path.join(base_dir, 'train2014_vgg16_fc7.h5')
-    with h5py.File(train_feat_file, 'r') as f:
-        data['train_features'] = np.asarray(f['features'])
+    if lazy:
+        data['train_features'] = H5Rows(train_feat_file, 'features',
+                                        cache_blocks=cache_blocks,
+                                        block_size=block_size)
+    else:
+        with h5py.File(train_feat_file, 'r') as f:
+            data['train_features'] = np.asarray(f['features'])
 
     if pca_features:
         val_feat_file = os.path.join(base_dir, 'val2014_vgg16_fc7_pca.h5')
     else:
         val_feat_file = os.path.join(base_dir, 'val2014_vgg16_fc7.h5')
-    with h5py.File(val_feat_file, 'r') as f:
-        data['val_features'] = np.asarray(f['features'])
+    if lazy:
+        data['val_features'] = H5Rows(val_feat_file, 'features',
+                                      cache_blocks=cache_blocks,
+                                      block_size=block_size)
+    else:
+        with h5py.File(val_feat_file, 'r') as f:
+            data['val_features'] = np.asarray(f['features'])
 
     dict_file = os.path.join(base_dir, 'coco2014_vocab.json')
     with open(dict_file, 'r') as f:
@@ -55,6 +183,16 @@ def load_coco_data(base_dir=BASE_DIR,
     return data
 
 
+def close_coco_data(data):
+    """
+    Close the HDF5 files kept open by load_coco_data(lazy=True); does
+    nothing for data loaded into memory.
+    """
+    for v in data.values():
+        if isinstance(v, H5Rows):
+            v.close()
+
+
 def decode_captions(captions, idx_to_word):
     singleton = False
     if captions.ndim == 1:
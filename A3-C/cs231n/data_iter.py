@@ -0,0 +1,141 @@
+import numpy as np
+
+"""
+Minibatch iteration over in-memory datasets.
+
+A BatchIterator walks over one or more arrays that share their first
+dimension (typically X and y) in minibatches. How the samples are ordered is
+decided by a sampler: a function sampler(num_samples, batch_size, drop_last,
+rng) that returns the batches of one epoch, each either a slice or an array of
+indices. The samplers below cover the usual cases; any function with the same
+signature can be passed to BatchIterator instead.
+"""
+
+
+def epoch_sampler(num_samples, batch_size, drop_last, rng):
+    """
+    A new random permutation every epoch, so every sample is used exactly once
+    per epoch. The indices within each batch are sorted, which keeps the batch
+    the same set of samples but makes gathering it walk memory forwards.
+    """
+    order = rng.permutation(num_samples)
+    return [np.sort(order[s]) for s in
+            sequential_sampler(num_samples, batch_size, drop_last, rng)]
+
+
+def sequential_sampler(num_samples, batch_size, drop_last, rng):
+    """
+    Contiguous slices in order. Batches are views of the data, not copies.
+    """
+    stop = num_samples - num_samples % batch_size if drop_last else num_samples
+    return [slice(start, min(start + batch_size, stop))
+            for start in range(0, stop, batch_size)]
+
+
+def shuffled_slices_sampler(num_samples, batch_size, drop_last, rng):
+    """
+    The contiguous slices of sequential_sampler in a random order each epoch.
+    Together with BatchIterator(shuffle='once'), which permutes the data once
+    up front, this gives random batches that are views rather than gathers.
+    """
+    slices = sequential_sampler(num_samples, batch_size, drop_last, rng)
+    return [slices[i] for i in rng.permutation(len(slices))]
+
+
+def replacement_sampler(num_samples, batch_size, drop_last, rng):
+    """
+    Independent batches drawn with replacement, the way Solver used to sample;
+    an epoch is just num_samples // batch_size of them.
+    """
+    num_batches = max(num_samples // batch_size, 1)
+    return [rng.choice(num_samples, batch_size) for _ in range(num_batches)]
+
+
+samplers = {
+  'epoch': epoch_sampler,
+  'once': shuffled_slices_sampler,
+  'replacement': replacement_sampler,
+  'none': sequential_sampler,
+}
+
+
+class BatchIterator(object):
+    """
+    Iterates over minibatches of a set of arrays with a common first dimension.
+
+    Example usage:
+
+    batches = BatchIterator((X_train, y_train), batch_size=100)
+    for X_batch, y_batch in batches:  # one epoch
+        ...
+    X_batch, y_batch = batches.next_batch()  # continues across epochs
+    """
+
+    def __init__(self, arrays, batch_size, shuffle='epoch', drop_last=False,
+                 sampler=None, seed=None):
+        """
+        Construct a new BatchIterator.
+
+        Inputs:
+        - arrays: Tuple of arrays of the same length N
+        - batch_size: Number of samples per batch
+        - shuffle: How to order the samples, one of the keys of samplers:
+            'epoch' draws a new permutation every epoch; 'once' permutes copies of
+            the arrays a single time and then serves contiguous slices in a random
+            order; 'replacement' samples every batch independently with
+            replacement; 'none' serves the data in order.
+        - drop_last: If True, skip the last batch of an epoch when it would be
+            smaller than batch_size.
+        - sampler: Optional function with the signature of the samplers above;
+            overrides shuffle.
+        - seed: If not None, seed a private random number generator; otherwise
+            the global np.random state is used.
+        """
+        self.arrays = tuple(arrays)
+        self.num_samples = self.arrays[0].shape[0]
+        for a in self.arrays:
+            if a.shape[0] != self.num_samples:
+                raise ValueError('All arrays must have the same length')
+        self.batch_size = batch_size
+        self.drop_last = drop_last
+        self.rng = np.random if seed is None else np.random.RandomState(seed)
+
+        if sampler is None:
+            if shuffle in (None, False):
+                shuffle = 'none'
+            if shuffle not in samplers:
+                raise ValueError('Invalid shuffle "%s"' % shuffle)
+            sampler = samplers[shuffle]
+            if shuffle == 'once':
+                order = self.rng.permutation(self.num_samples)
+                self.arrays = tuple(a[order] for a in self.arrays)
+        self.sampler = sampler
+
+        self.epoch = 0
+        self._batches = None
+
+    def __len__(self):
+        """ Number of batches in one epoch. """
+        return len(self.sampler(self.num_samples, self.batch_size, self.drop_last,
+                                np.random.RandomState(0)))
+
+    def __iter__(self):
+        """ Iterate over the batches of one epoch. """
+        for index in self.sampler(self.num_samples, self.batch_size,
+                                  self.drop_last, self.rng):
+            yield tuple(a[index] for a in self.arrays)
+
+    def next_batch(self):
+        """
+        Returns the next batch as a tuple with one entry per array, starting a
+        new epoch (and incrementing self.epoch) whenever the current one is
+        exhausted.
+        """
+        if self._batches is None:
+            self._batches = iter(self)
+        try:
+            return next(self._batches)
+        except StopIteration:
+            self.epoch += 1
+            self._batches = iter(self)
+            return next(self._batches)
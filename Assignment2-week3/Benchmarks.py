@@ -0,0 +1,166 @@
+
+# coding: utf-8
+
+# # Benchmarks
+# Timings for the alternative implementations in cs231n.fast_layers and
+# cs231n.layers. Run this
+# from the assignment directory, e.g. `python Benchmarks.py conv`.
+
+import sys
+import tracemalloc
+from time import time
+
+import numpy as np
+
+from cs231n.fast_layers import *
+from cs231n.layers import *
+from cs231n import optim
+
+
+def best_time(f, num_repeats=3):
+  """ Return the fastest of num_repeats wall-clock timings of f(). """
+  times = []
+  for _ in range(num_repeats):
+    t0 = time()
+    f()
+    times.append(time() - t0)
+  return min(times)
+
+
+# ## Convolution
+# Forward + backward time of every conv method for a range of layer shapes,
+# next to the method conv_forward_fast would pick from conv_cost. Winograd
+# needs 3x3 stride 1 filters and large channel counts to pay for its
+# transforms, the FFT wins for large filters, and strides wins everywhere
+# else.
+
+def benchmark_conv(dtype=np.float32):
+  shapes = [
+    # (N, C, H, W), (F, HH, WW), stride
+    ((100, 3, 32, 32), (32, 3, 3), 1),
+    ((100, 32, 32, 32), (32, 3, 3), 1),
+    ((64, 64, 16, 16), (64, 3, 3), 1),
+    ((32, 128, 16, 16), (128, 3, 3), 1),
+    ((32, 256, 8, 8), (256, 3, 3), 1),
+    ((100, 3, 32, 32), (32, 5, 5), 1),
+    ((100, 3, 32, 32), (32, 7, 7), 1),
+    ((100, 32, 32, 32), (32, 7, 7), 1),
+    ((50, 32, 32, 32), (32, 9, 9), 1),
+    ((50, 16, 32, 32), (16, 11, 11), 1),
+    ((10, 3, 64, 64), (16, 15, 15), 1),
+    ((100, 32, 31, 31), (32, 7, 7), 2),
+    ((100, 3, 31, 31), (32, 3, 3), 2),
+  ]
+  print('%-36s %9s %9s %9s %9s   %-8s %-8s' % (
+        'shape', 'strides', 'im2col', 'winograd', 'fft', 'fastest', 'chosen'))
+  for x_shape, (F, HH, WW), stride in shapes:
+    N, C, H, W = x_shape
+    pad = (HH - 1) // 2
+    x = np.random.randn(*x_shape).astype(dtype)
+    w = np.random.randn(F, C, HH, WW).astype(dtype)
+    b = np.random.randn(F).astype(dtype)
+    conv_param = {'stride': stride, 'pad': pad}
+    costs = conv_cost(x.shape, w.shape, conv_param)
+
+    times = {}
+    for method in costs:
+      param = dict(conv_param, method=method)
+      def run():
+        out, cache = conv_forward_fast(x, w, b, param)
+        conv_backward_fast(out, cache)
+      times[method] = best_time(run)
+
+    name = '%s * %dx%dx%d /%d' % (x_shape, F, HH, WW, stride)
+    cells = ['%9.4f' % times[m] if m in times else '%9s' % '-'
+             for m in ('strides', 'im2col', 'winograd', 'fft')]
+    print('%-36s %s   %-8s %-8s' % (name, ' '.join(cells),
+          min(times, key=times.get), min(costs, key=costs.get)))
+
+
+# ## Batch normalization
+# Forward + backward time of batchnorm_forward with the staged and the
+# simplified backward pass against batchnorm_forward_fast, for (N, D) data and
+# for spatial batchnorm over (N, C, H, W) data, where the old path transposes
+# to an (N * H * W, C) matrix and back.
+
+def benchmark_batchnorm(dtype=np.float32):
+  def old_spatial(x, gamma, beta, bn_param, backward):
+    N, C, H, W = x.shape
+    flat = x.transpose(0, 2, 3, 1).reshape(-1, C)
+    out, cache = batchnorm_forward(flat, gamma, beta, bn_param)
+    out = out.reshape(N, H, W, C).transpose(0, 3, 1, 2)
+    dout = out.transpose(0, 2, 3, 1).reshape(-1, C)
+    dx, _, _ = backward(dout, cache)
+    return dx.reshape(N, H, W, C).transpose(0, 3, 1, 2)
+
+  def fast(x, gamma, beta, bn_param, axis):
+    out, cache = batchnorm_forward_fast(x, gamma, beta, bn_param, axis=axis)
+    return batchnorm_backward_fast(out, cache)
+
+  shapes = [(100, 100), (1000, 1000), (10000, 500),
+            (100, 32, 32, 32), (50, 64, 16, 16)]
+  print('%-20s %9s %9s %9s %8s' % ('shape', 'staged', 'alt', 'fast', 'speedup'))
+  for shape in shapes:
+    x = np.random.randn(*shape).astype(dtype)
+    D = shape[1]
+    gamma, beta = np.ones(D, dtype=dtype), np.zeros(D, dtype=dtype)
+    bn_param = {'mode': 'train'}
+    if len(shape) == 2:
+      def staged():
+        out, cache = batchnorm_forward(x, gamma, beta, bn_param)
+        batchnorm_backward(out, cache)
+      def alt():
+        out, cache = batchnorm_forward(x, gamma, beta, bn_param)
+        batchnorm_backward_alt(out, cache)
+      axis = 0
+    else:
+      staged = lambda: old_spatial(x, gamma, beta, bn_param, batchnorm_backward)
+      alt = lambda: old_spatial(x, gamma, beta, bn_param, batchnorm_backward_alt)
+      axis = (0, 2, 3)
+    times = [best_time(f) for f in
+             (staged, alt, lambda: fast(x, gamma, beta, bn_param, axis))]
+    print('%-20s %9.4f %9.4f %9.4f %7.1fx' % (
+          (shape,) + tuple(times) + (times[1] / times[2],)))
+
+
+# ## Update rules
+# Wall time and peak memory allocated per step of each update rule on the
+# weights of a 3072-1000-1000-10 FullyConnectedNet, with the default rules
+# allocating new arrays and with config['in_place'] set.
+
+def benchmark_optim(dtype=np.float32, num_steps=10):
+  shapes = [(3072, 1000), (1000,), (1000, 1000), (1000,), (1000, 10), (10,)]
+  params = [np.random.randn(*shape).astype(dtype) for shape in shapes]
+  grads = [np.random.randn(*shape).astype(dtype) for shape in shapes]
+  print('%-14s %-9s %10s %12s' % ('rule', 'mode', 'time/step', 'alloc/step'))
+  for rule in ('sgd_momentum', 'rmsprop', 'adam'):
+    update = getattr(optim, rule)
+    for in_place in (False, True):
+      ws = [w.copy() for w in params]
+      configs = [{'learning_rate': 1e-4, 'in_place': in_place} for _ in ws]
+      def step():
+        for i, (w, dw) in enumerate(zip(ws, grads)):
+          ws[i], configs[i] = update(w, dw, configs[i])
+      step()  # allocate the optimizer state
+      t = best_time(step, num_steps)
+
+      tracemalloc.start()
+      step()
+      _, peak = tracemalloc.get_traced_memory()
+      tracemalloc.stop()
+      print('%-14s %-9s %9.2fms %10.1fMB' % (
+            rule, 'in-place' if in_place else 'default', 1000 * t, peak / 1e6))
+
+
+benchmarks = {
+  'conv': benchmark_conv,
+  'batchnorm': benchmark_batchnorm,
+  'optim': benchmark_optim,
+}
+
+
+if __name__ == '__main__':
+  names = sys.argv[1:] or sorted(benchmarks)
+  for name in names:
+    print('\n== %s' % name)
+    benchmarks[name]()
@@ -291,6 +291,61 @@ print('dw difference: ', rel_error(dw_naive, dw_fast))
 print('db difference: ', rel_error(db_naive, db_fast))
 
 
+# `conv_forward_fast` picks one of several methods from a cost model, and on small layers like the ones above it never picks Winograd. The following cell forces `conv_param['method'] = 'winograd'` (which needs 3x3 filters with stride 1) and checks the forward pass against the naive one and the backward pass numerically; use an odd output size so the edge tiles are covered too. You should see errors less than 1e-8.
+
+# In[ ]:
+
+
+np.random.seed(231)
+x = np.random.randn(2, 3, 7, 7)
+w = np.random.randn(4, 3, 3, 3)
+b = np.random.randn(4,)
+dout = np.random.randn(2, 4, 7, 7)
+conv_param = {'stride': 1, 'pad': 1, 'method': 'winograd'}
+
+out_naive, _ = conv_forward_naive(x, w, b, conv_param)
+out, cache = conv_forward_fast(x, w, b, conv_param)
+dx, dw, db = conv_backward_fast(dout, cache)
+
+dx_num = eval_numerical_gradient_array(lambda x: conv_forward_fast(x, w, b, conv_param)[0], x, dout)
+dw_num = eval_numerical_gradient_array(lambda w: conv_forward_fast(x, w, b, conv_param)[0], w, dout)
+db_num = eval_numerical_gradient_array(lambda b: conv_forward_fast(x, w, b, conv_param)[0], b, dout)
+
+print('Testing winograd:')
+print('difference: ', rel_error(out_naive, out))
+print('dx error: ', rel_error(dx, dx_num))
+print('dw error: ', rel_error(dw, dw_num))
+print('db error: ', rel_error(db, db_num))
+
+
+# The FFT method is only picked for large filters. The following cell forces `conv_param['method'] = 'fft'` on a 5x5 layer, with stride 1 and with stride 2 (which computes every output position and then subsamples), and checks it the same way. The numerical gradients of a 5x5 layer are less accurate, so you should see errors less than 1e-5.
+
+# In[ ]:
+
+
+np.random.seed(231)
+x = np.random.randn(2, 3, 9, 9)
+w = np.random.randn(4, 3, 5, 5)
+b = np.random.randn(4,)
+
+for stride in [1, 2]:
+  conv_param = {'stride': stride, 'pad': 2, 'method': 'fft'}
+  out_naive, _ = conv_forward_naive(x, w, b, conv_param)
+  out, cache = conv_forward_fast(x, w, b, conv_param)
+  dout = np.random.randn(*out.shape)
+  dx, dw, db = conv_backward_fast(dout, cache)
+
+  dx_num = eval_numerical_gradient_array(lambda x: conv_forward_fast(x, w, b, conv_param)[0], x, dout)
+  dw_num = eval_numerical_gradient_array(lambda w: conv_forward_fast(x, w, b, conv_param)[0], w, dout)
+  db_num = eval_numerical_gradient_array(lambda b: conv_forward_fast(x, w, b, conv_param)[0], b, dout)
+
+  print('Testing fft with stride %d:' % stride)
+  print('difference: ', rel_error(out_naive, out))
+  print('dx error: ', rel_error(dx, dx_num))
+  print('dw error: ', rel_error(dw, dw_num))
+  print('db error: ', rel_error(db, db_num))
+
+
 # In[9]:
 
 
@@ -357,7 +412,7 @@ print('db error: ', rel_error(db_num, db))
 
 from cs231n.layer_utils import conv_relu_forward, conv_relu_backward
 
-x = np.random.randn(2, 3, 8, 8)
+x = np.random.randn(2, 3, 9, 9)
 w = np.random.randn(3, 3, 3, 3)
 b = np.random.randn(3,)
 dout = np.random.randn(2, 3, 8, 8)
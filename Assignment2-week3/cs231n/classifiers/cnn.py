@@ -13,12 +13,13 @@ class ThreeLayerConvNet(object):
   
   The network operates on minibatches of data that have shape (N, C, H, W)
   consisting of N images, each with height H and width W and with C input
-  channels.
+  channels; with layout='NHWC' the minibatches have shape (N, H, W, C)
+  instead.
   """
   
   def __init__(self, input_dim=(3, 32, 32), num_filters=32, filter_size=7,
                hidden_dim=100, num_classes=10, weight_scale=1e-3, reg=0.0,
-               dtype=np.float32):
+               dtype=np.float32, conv_tile_size=None, layout='NCHW'):
     """
     Initialize a new network.
     
@@ -32,10 +33,19 @@ class ThreeLayerConvNet(object):
       of weights.
     - reg: Scalar giving L2 regularization strength
     - dtype: numpy datatype to use for computation.
+    - conv_tile_size: If not None, run the convolutional layer on chunks of
+      this many images at a time, which bounds its memory use at the cost of
+      recomputing the im2col columns in the backward pass.
+    - layout: 'NCHW' or 'NHWC'; the memory layout of the input data and of
+      the activations of the convolutional and pooling layers. input_dim is
+      (C, H, W) in both cases.
     """
     self.params = {}
     self.reg = reg
     self.dtype = dtype
+    self.conv_tile_size = conv_tile_size
+    self.layout = layout
+    self._predict_buffers = {}
     
     ############################################################################
     # TODO: Initialize weights and biases for the three-layer convolutional    #
@@ -63,22 +73,69 @@ class ThreeLayerConvNet(object):
       self.params[k] = v.astype(dtype)
      
  
+  def __setstate__(self, state):
+    # Models pickled before these attributes existed get their defaults
+    state.setdefault('conv_tile_size', None)
+    state.setdefault('layout', 'NCHW')
+    state.setdefault('_predict_buffers', {})
+    self.__dict__.update(state)
+
+
+  def _layer_params(self):
+    """ Returns the conv_param and pool_param of the network's layers. """
+    # pass conv_param to the forward pass for the convolutional layer
+    filter_size = self.params['W1'].shape[2]
+    conv_param = {'stride': 1, 'pad': (filter_size - 1) // 2}
+    if self.conv_tile_size is not None:
+      conv_param['tile_size'] = self.conv_tile_size
+
+    # pass pool_param to the forward pass for the max-pooling layer
+    pool_param = {'pool_height': 2, 'pool_width': 2, 'stride': 2}
+
+    conv_param['layout'] = pool_param['layout'] = self.layout
+    return conv_param, pool_param
+
+
+  def predict(self, X):
+    """
+    Test-time forward pass for the three-layer convolutional network. No
+    caches are built (in particular no im2col columns are kept), and the
+    hidden affine layer writes into a buffer that is reused across calls, so
+    predict is not thread-safe.
+
+    Inputs:
+    - X: Array of input data as for loss
+
+    Returns:
+    - scores: Array of shape (N, C) giving classification scores
+    """
+    conv_param, pool_param = self._layer_params()
+    pooled = conv_relu_pool_predict(X, self.params['W1'], self.params['b1'],
+                                    conv_param, pool_param)
+    W2, W3 = self.params['W2'], self.params['W3']
+    hidden = predict_buffer(self._predict_buffers, 'hidden',
+                            (X.shape[0], W2.shape[1]),
+                            np.result_type(pooled, W2))
+    affine_forward_into(pooled, W2, self.params['b2'], hidden, relu=True)
+    scores = hidden.dot(W3)
+    scores += self.params['b3']
+    return scores
+
+
   def loss(self, X, y=None):
     """
     Evaluate loss and gradient for the three-layer convolutional network.
     
-    Input / output: Same API as TwoLayerNet in fc_net.py.
+    Input / output: Same API as TwoLayerNet in fc_net.py. If y is None the
+    scores are computed by predict.
     """
+    if y is None:
+      return self.predict(X)
+
     W1, b1 = self.params['W1'], self.params['b1']
     W2, b2 = self.params['W2'], self.params['b2']
     W3, b3 = self.params['W3'], self.params['b3']
-    
-    # pass conv_param to the forward pass for the convolutional layer
-    filter_size = W1.shape[2]
-    conv_param = {'stride': 1, 'pad': (filter_size - 1) / 2}
-
-    # pass pool_param to the forward pass for the max-pooling layer
-    pool_param = {'pool_height': 2, 'pool_width': 2, 'stride': 2}
+    conv_param, pool_param = self._layer_params()
 
     scores = None
     ############################################################################
@@ -95,9 +152,6 @@ class ThreeLayerConvNet(object):
     #                             END OF YOUR CODE                             #
     ############################################################################
     
-    if y is None:
-      return scores
-    
     loss, grads = 0, {}
     ############################################################################
     # TODO: Implement the backward pass for the three-layer convolutional net, #
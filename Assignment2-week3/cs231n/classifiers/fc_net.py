@@ -167,6 +167,7 @@ class FullyConnectedNet(object):
     self.num_layers = 1 + len(hidden_dims)
     self.dtype = dtype
     self.params = {}
+    self._predict_buffers = {}
 
     ############################################################################
     # TODO: Initialize the parameters of the network, storing all values in    #
@@ -219,14 +220,57 @@ class FullyConnectedNet(object):
       self.params[k] = v.astype(dtype)
 
 
+  def __setstate__(self, state):
+    # Models pickled before predict() existed have no buffers
+    state.setdefault('_predict_buffers', {})
+    self.__dict__.update(state)
+
+
+  def predict(self, X):
+    """
+    Test-time forward pass for the fully-connected net.
+
+    No caches are built and dropout is skipped. Batch normalization is folded
+    into the weights of the affine layer before it, and the hidden
+    activations are written into two buffers that are reused across layers
+    and across calls, so predict is not thread-safe.
+
+    Inputs:
+    - X: Array of input data of shape (N, d_1, ..., d_k)
+
+    Returns:
+    - scores: Array of shape (N, C) giving classification scores
+    """
+    X = X.astype(self.dtype, copy=False)
+    N = X.shape[0]
+    h = X.reshape(N, -1)
+    for lay in range(self.num_layers - 1):
+      w, b = self.params['W%d' % (lay + 1)], self.params['b%d' % (lay + 1)]
+      if self.use_batchnorm:
+        w_buffer = predict_buffer(self._predict_buffers, ('W', lay), w.shape,
+                                  w.dtype)
+        w, b = batchnorm_fold(w, b, self.params['gamma%d' % (lay + 1)],
+                              self.params['beta%d' % (lay + 1)],
+                              self.bn_params[lay], out=w_buffer)
+      out = predict_buffer(self._predict_buffers, lay % 2, (N, w.shape[1]),
+                           np.result_type(h, w))
+      h = affine_forward_into(h, w, b, out, relu=True)
+    scores = h.dot(self.params['W%d' % self.num_layers])
+    scores += self.params['b%d' % self.num_layers]
+    return scores
+
+
   def loss(self, X, y=None):
     """
     Compute loss and gradient for the fully-connected net.
 
-    Input / output: Same as TwoLayerNet above.
+    Input / output: Same as TwoLayerNet above. If y is None the scores are
+    computed by predict.
     """
-    X = X.astype(self.dtype)
-    mode = 'test' if y is None else 'train'
+    if y is None:
+      return self.predict(X)
+    X = X.astype(self.dtype, copy=False)
+    mode = 'train'
 
     # Set train/test mode for batchnorm params and dropout param since they
     # behave differently during training and testing.
@@ -271,10 +315,6 @@ class FullyConnectedNet(object):
     #                             END OF YOUR CODE                             #
     ############################################################################
 
-    # If test mode return early
-    if mode == 'test':
-      return scores
-
     loss, grads = 0.0, {}
     ############################################################################
     # TODO: Implement the backward pass for the fully-connected net. Store the #
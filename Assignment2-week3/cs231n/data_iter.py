@@ -0,0 +1,336 @@
+import queue
+import threading
+
+import numpy as np
+
+"""
+Minibatch iteration over in-memory datasets.
+
+A BatchIterator walks over one or more arrays that share their first
+dimension (typically X and y) in minibatches. How the samples are ordered is
+decided by a sampler: a function sampler(num_samples, batch_size, drop_last,
+rng) that returns the batches of one epoch, each either a slice or an array of
+indices. The samplers below cover the usual cases; any function with the same
+signature can be passed to BatchIterator instead. A PrefetchIterator
+prepares the batches of a BatchIterator ahead of time in a worker thread.
+
+Datasets can also be kept as raw uint8 pixels, an eighth of the size of
+float64, with the mean subtraction and the conversion to floating point done
+per batch by normalize_batch; see the mean argument of BatchIterator.
+"""
+
+
+def normalize_batch(X, mean, dtype=np.float64, out=None):
+  """
+  Subtract mean from a batch of (typically uint8) data and convert it to
+  dtype. X is cast straight into the result, from which mean (in dtype) is
+  then subtracted in place; with NumPy's casting loops this is faster than a
+  single mixed-type subtraction and allocates nothing but the result.
+
+  Inputs:
+  - X: Batch of data of shape (N, d_1, ..., d_k)
+  - mean: Array broadcastable to X, such as the mean image of shape
+    (d_1, ..., d_k)
+  - dtype: dtype of the result; ignored if out is given
+  - out: Optional array of the shape of X to write the result into
+
+  Returns:
+  - out: The normalized batch
+  """
+  if out is None:
+    out = np.empty(X.shape, dtype=dtype)
+  np.copyto(out, X, casting='unsafe')
+  out -= mean.astype(out.dtype, copy=False)
+  return out
+
+
+def epoch_sampler(num_samples, batch_size, drop_last, rng):
+  """
+  A new random permutation every epoch, so every sample is used exactly once
+  per epoch. The indices within each batch are sorted, which keeps the batch
+  the same set of samples but makes gathering it walk memory forwards.
+  """
+  order = rng.permutation(num_samples)
+  return [np.sort(order[s]) for s in
+          sequential_sampler(num_samples, batch_size, drop_last, rng)]
+
+
+def sequential_sampler(num_samples, batch_size, drop_last, rng):
+  """
+  Contiguous slices in order. Batches are views of the data, not copies.
+  """
+  stop = num_samples - num_samples % batch_size if drop_last else num_samples
+  return [slice(start, min(start + batch_size, stop))
+          for start in range(0, stop, batch_size)]
+
+
+def shuffled_slices_sampler(num_samples, batch_size, drop_last, rng):
+  """
+  The contiguous slices of sequential_sampler in a random order each epoch.
+  Together with BatchIterator(shuffle='once'), which permutes the data once
+  up front, this gives random batches that are views rather than gathers.
+  """
+  slices = sequential_sampler(num_samples, batch_size, drop_last, rng)
+  return [slices[i] for i in rng.permutation(len(slices))]
+
+
+def replacement_sampler(num_samples, batch_size, drop_last, rng):
+  """
+  Independent batches drawn with replacement, the way Solver used to sample;
+  an epoch is just num_samples // batch_size of them.
+  """
+  num_batches = max(num_samples // batch_size, 1)
+  return [rng.choice(num_samples, batch_size) for _ in range(num_batches)]
+
+
+samplers = {
+  'epoch': epoch_sampler,
+  'once': shuffled_slices_sampler,
+  'replacement': replacement_sampler,
+  'none': sequential_sampler,
+}
+
+
+class BatchIterator(object):
+  """
+  Iterates over minibatches of a set of arrays with a common first dimension.
+
+  Example usage:
+
+  batches = BatchIterator((X_train, y_train), batch_size=100)
+  for X_batch, y_batch in batches:  # one epoch
+    ...
+  X_batch, y_batch = batches.next_batch()  # continues across epochs
+  """
+
+  def __init__(self, arrays, batch_size, shuffle='epoch', drop_last=False,
+               sampler=None, seed=None, mean=None, dtype=np.float64):
+    """
+    Construct a new BatchIterator.
+
+    Inputs:
+    - arrays: Tuple of arrays of the same length N
+    - batch_size: Number of samples per batch
+    - shuffle: How to order the samples, one of the keys of samplers:
+      'epoch' draws a new permutation every epoch; 'once' permutes copies of
+      the arrays a single time and then serves contiguous slices in a random
+      order; 'replacement' samples every batch independently with
+      replacement; 'none' serves the data in order.
+    - drop_last: If True, skip the last batch of an epoch when it would be
+      smaller than batch_size.
+    - sampler: Optional function with the signature of the samplers above;
+      overrides shuffle.
+    - seed: If not None, seed a private random number generator; otherwise
+      the global np.random state is used. With a seed, next_index draws each
+      epoch from np.random.RandomState([seed, epoch]), so the batches of an
+      epoch depend only on the seed and the epoch number, whichever thread
+      draws them and however far ahead (see set_epoch).
+    - mean: If not None, every batch of the first array is converted to dtype
+      with mean subtracted by normalize_batch; this lets the first array
+      hold raw uint8 data.
+    - dtype: dtype of the normalized batches of the first array.
+    """
+    self.arrays = tuple(arrays)
+    self.num_samples = self.arrays[0].shape[0]
+    for a in self.arrays:
+      if a.shape[0] != self.num_samples:
+        raise ValueError('All arrays must have the same length')
+    self.batch_size = batch_size
+    self.drop_last = drop_last
+    self.mean = mean
+    self.dtype = np.dtype(dtype)
+    self.seed = seed
+    self.rng = np.random if seed is None else np.random.RandomState(seed)
+
+    if sampler is None:
+      if shuffle in (None, False):
+        shuffle = 'none'
+      if shuffle not in samplers:
+        raise ValueError('Invalid shuffle "%s"' % shuffle)
+      sampler = samplers[shuffle]
+      if shuffle == 'once':
+        order = self.rng.permutation(self.num_samples)
+        self.arrays = tuple(a[order] for a in self.arrays)
+    self.sampler = sampler
+
+    self.epoch = 0
+    self._indices = None
+
+  def __len__(self):
+    """ Number of batches in one epoch. """
+    return len(self.sampler(self.num_samples, self.batch_size, self.drop_last,
+                            np.random.RandomState(0)))
+
+  def __iter__(self):
+    """ Iterate over the batches of one epoch. """
+    for index in self.sampler(self.num_samples, self.batch_size,
+                              self.drop_last, self.rng):
+      yield self._batch(index)
+
+  def _batch(self, index):
+    batch = tuple(a[index] for a in self.arrays)
+    if self.mean is not None:
+      batch = (normalize_batch(batch[0], self.mean, self.dtype),) + batch[1:]
+    return batch
+
+  def _epoch_indices(self):
+    rng = self.rng
+    if self.seed is not None:
+      rng = np.random.RandomState([self.seed, self.epoch])
+    return iter(self.sampler(self.num_samples, self.batch_size,
+                             self.drop_last, rng))
+
+  def set_epoch(self, epoch):
+    """
+    Make the next batch the first one of epoch number epoch. With a seed
+    this replays the same batches as the first time through that epoch.
+    """
+    self.epoch = epoch
+    self._indices = None
+
+  def next_index(self):
+    """
+    Returns the index (a slice or an array of indices) of the next batch,
+    starting a new epoch (and incrementing self.epoch) whenever the current
+    one is exhausted.
+    """
+    if self._indices is None:
+      self._indices = self._epoch_indices()
+    try:
+      return next(self._indices)
+    except StopIteration:
+      self.epoch += 1
+      self._indices = self._epoch_indices()
+      return next(self._indices)
+
+  def next_batch(self):
+    """
+    Returns the next batch as a tuple with one entry per array; see
+    next_index.
+    """
+    return self._batch(self.next_index())
+
+
+class PrefetchIterator(object):
+  """
+  Prepares the next batches of a BatchIterator in a background thread.
+
+  The batches are gathered into a ring of preallocated buffers, optionally
+  casting each array to a new dtype and applying a transform such as data
+  augmentation on the way, while the training thread runs forward and
+  backward passes (NumPy releases the GIL in BLAS calls and most copies).
+
+  A batch returned by next_batch stays valid until the following call to
+  next_batch, after which its buffers are reused. Call close() when done, or
+  the worker thread keeps running.
+
+  The worker thread draws the batch indices, ahead of the training thread,
+  so give the BatchIterator a seed for reproducible runs: drawing from the
+  global np.random state would race with the training thread.
+  """
+
+  def __init__(self, batches, num_prefetch=2, dtypes=None, transform=None):
+    """
+    Construct a new PrefetchIterator and start its worker thread.
+
+    Inputs:
+    - batches: A BatchIterator
+    - num_prefetch: Number of batches to prepare ahead of the current one
+    - dtypes: Optional tuple with one dtype (or None to keep the dtype) per
+      array of batches. If batches has a mean, the first array is normalized
+      (by default to the dtype of batches) as it is gathered.
+    - transform: Optional function called in the worker thread on each batch
+      tuple, returning the tuple to hand out instead
+    """
+    self.batches = batches
+    self.transform = transform
+    if dtypes is None:
+      dtypes = (None,) * len(batches.arrays)
+    self.dtypes = tuple(a.dtype if d is None else np.dtype(d)
+                        for a, d in zip(batches.arrays, dtypes))
+    if batches.mean is not None and dtypes[0] is None:
+      self.dtypes = (batches.dtype,) + self.dtypes[1:]
+
+    # One more slot than num_prefetch for the batch in use
+    self.buffers = [tuple(np.empty((batches.batch_size,) + a.shape[1:], dtype=d)
+                          for a, d in zip(batches.arrays, self.dtypes))
+                    for _ in range(num_prefetch + 1)]
+    # The raw first array of each batch is gathered here before normalizing
+    self.raw_buffers = None
+    if batches.mean is not None:
+      first = batches.arrays[0]
+      self.raw_buffers = [np.empty((batches.batch_size,) + first.shape[1:],
+                                   dtype=first.dtype)
+                          for _ in range(num_prefetch + 1)]
+    self._free = queue.Queue()
+    self._ready = queue.Queue()
+    for i in range(num_prefetch + 1):
+      self._free.put(i)
+    self._current = None
+    self._stop = threading.Event()
+    self._thread = threading.Thread(target=self._work)
+    self._thread.daemon = True
+    self._thread.start()
+
+  def __len__(self):
+    return len(self.batches)
+
+  @property
+  def epoch(self):
+    return self.batches.epoch
+
+  def _fill(self, slot, index):
+    """ Gather the batch at index into the buffers of slot. """
+    batch = []
+    for i, (a, buf) in enumerate(zip(self.batches.arrays, self.buffers[slot])):
+      if isinstance(index, slice):
+        n = len(range(*index.indices(a.shape[0])))
+      else:
+        n = len(index)
+      if i == 0 and self.raw_buffers is not None:
+        # Gather the raw data first unless the batch is a view anyway
+        if isinstance(index, slice):
+          raw = a[index]
+        else:
+          raw = np.take(a, index, axis=0, out=self.raw_buffers[slot][:n])
+        normalize_batch(raw, self.batches.mean, out=buf[:n])
+      elif isinstance(index, slice):
+        np.copyto(buf[:n], a[index])
+      elif buf.dtype == a.dtype:
+        np.take(a, index, axis=0, out=buf[:n])
+      else:
+        buf[:n] = a[index]
+      batch.append(buf[:n])
+    return tuple(batch)
+
+  def _work(self):
+    try:
+      while not self._stop.is_set():
+        try:
+          slot = self._free.get(timeout=0.1)
+        except queue.Empty:
+          continue
+        batch = self._fill(slot, self.batches.next_index())
+        if self.transform is not None:
+          batch = self.transform(batch)
+        self._ready.put((slot, batch))
+    except Exception as e:
+      self._ready.put((None, e))
+
+  def next_batch(self):
+    """
+    Returns the next prepared batch, waiting for the worker if needed.
+    """
+    if self._current is not None:
+      self._free.put(self._current)
+      self._current = None
+    slot, batch = self._ready.get()
+    if slot is None:
+      raise batch
+    self._current = slot
+    return batch
+
+  def close(self):
+    """ Stop the worker thread. """
+    self._stop.set()
+    self._thread.join()
@@ -0,0 +1,218 @@
+import multiprocessing
+from multiprocessing import shared_memory
+
+import numpy as np
+
+"""
+Data-parallel loss and gradient computation over a pool of worker processes.
+
+Each minibatch is split into one contiguous shard per worker; every shard
+runs through model.loss in a worker, and the gradients are averaged, weighted
+by the shard sizes, which gives the gradient of the whole minibatch. As in
+parallel_eval.py the workers are forked and their model.params are views of
+shared memory blocks that the parent refreshes before every step. The
+minibatch and the per-shard gradients go through shared memory too; only the
+shard bounds, the losses and the small batchnorm running averages are
+pickled.
+
+Each shard seeds np.random with [seed, step, shard], so dropout masks are
+deterministic whichever worker picks up a shard, and the parent never draws
+from np.random: the batches a Solver samples from it are the same as in a
+serial run.
+"""
+
+# Set in each worker by _init_worker
+_worker = {}
+
+
+def _attach(name, shape, dtype):
+  """ Map an existing shared memory block as an array. """
+  shm = shared_memory.SharedMemory(name=name)
+  return shm, np.ndarray(shape, dtype=dtype, buffer=shm.buf)
+
+
+def _running_averages(model):
+  """
+  Returns a list with a dictionary of the batchnorm running averages of each
+  entry of model.bn_params (an empty list if the model has none).
+  """
+  return [{k: bn_param[k] for k in ('running_mean', 'running_var')
+           if k in bn_param}
+          for bn_param in getattr(model, 'bn_params', [])]
+
+
+def _init_worker(model, param_specs, grad_specs):
+  _worker['model'] = model
+  _worker['blocks'] = {}
+  _worker['grads'] = {}
+  _worker['batch'] = {}
+  for k, (name, shape, dtype) in param_specs.items():
+    shm, model.params[k] = _attach(name, shape, dtype)
+    _worker['blocks'][name] = (shm, model.params[k])
+  for k, (name, shape, dtype) in grad_specs.items():
+    shm, _worker['grads'][k] = _attach(name, shape, dtype)
+    _worker['blocks'][name] = (shm, _worker['grads'][k])
+
+
+def _batch_arrays(x_spec, y_spec):
+  """
+  The arrays of the shared minibatch blocks, attached on first use in this
+  worker. Blocks the parent has since replaced are closed.
+  """
+  batch = _worker['batch']
+  for name in [n for n in batch if n not in (x_spec[0], y_spec[0])]:
+    shm, array = batch.pop(name)
+    del array
+    shm.close()
+  for name, shape, dtype in (x_spec, y_spec):
+    if name not in batch:
+      batch[name] = _attach(name, shape, dtype)
+  return batch[x_spec[0]][1], batch[y_spec[0]][1]
+
+
+def _shard_loss(args):
+  """
+  Run model.loss on the samples start:end of the shared minibatch and write
+  the gradients into slot shard of the shared gradients. Returns the loss and
+  the updated batchnorm running averages.
+  """
+  x_spec, y_spec, shard, start, end, seed, running_averages = args
+  model = _worker['model']
+  for bn_param, averages in zip(getattr(model, 'bn_params', []),
+                                running_averages):
+    bn_param.update(averages)
+  np.random.seed(seed + [shard])
+
+  X, y = _batch_arrays(x_spec, y_spec)
+  loss, grads = model.loss(X[start:end], y[start:end])
+  for k, g in grads.items():
+    _worker['grads'][k][shard] = g
+  return loss, _running_averages(model)
+
+
+class DataParallel(object):
+  """
+  Computes the loss and gradients of a model on a minibatch with a pool of
+  forked worker processes.
+
+  Example usage:
+
+  parallel = DataParallel(model, num_workers=4)
+  loss, grads = parallel.loss(X_batch, y_batch)
+  parallel.close()
+  """
+
+  def __init__(self, model, num_workers, seed=0):
+    """
+    Create the shared memory blocks for the params and gradients of model
+    and start the workers.
+
+    Inputs:
+    - model: A model as described in solver.py
+    - num_workers: Number of worker processes, and of shards per minibatch
+    - seed: Seed of the random numbers (dropout masks) of the shards
+    """
+    self.model = model
+    self.num_workers = num_workers
+    self.seed = seed
+    # Number of calls to loss so far; the shards of each call get their own
+    # random numbers
+    self.step = 0
+    self.blocks = {}
+    self.params = {}
+    self.shard_grads = {}
+    self.grads = {}
+    param_specs, grad_specs = {}, {}
+    for k, v in model.params.items():
+      self.params[k], param_specs[k] = self._create(v.shape, v.dtype)
+      self.shard_grads[k], grad_specs[k] = self._create(
+          (num_workers,) + v.shape, v.dtype)
+      self.grads[k] = np.empty(v.shape, dtype=v.dtype)
+    self.x_spec = self.y_spec = None
+
+    # Fork, so that the workers inherit the model instead of unpickling it
+    context = multiprocessing.get_context('fork')
+    self.pool = context.Pool(num_workers, initializer=_init_worker,
+                             initargs=(model, param_specs, grad_specs))
+
+  def _create(self, shape, dtype):
+    """ Returns a new shared array and its (name, shape, dtype) spec. """
+    dtype = np.dtype(dtype)
+    size = max(int(np.prod(shape)) * dtype.itemsize, 1)
+    shm = shared_memory.SharedMemory(create=True, size=size)
+    array = np.ndarray(shape, dtype=dtype, buffer=shm.buf)
+    self.blocks[shm.name] = (shm, array)
+    return array, (shm.name, shape, dtype)
+
+  def _batch_block(self, spec, a):
+    """
+    Copy a into the shared block of spec, replacing the block with a new
+    one first if it does not fit (and freeing the old one). Returns the spec
+    of the block.
+    """
+    if (spec is None or spec[1][0] < a.shape[0]
+        or spec[1][1:] != a.shape[1:] or spec[2] != a.dtype):
+      if spec is not None:
+        self._free(spec[0])
+      _, spec = self._create(a.shape, a.dtype)
+    self.blocks[spec[0]][1][:a.shape[0]] = a
+    return spec
+
+  def loss(self, X, y):
+    """
+    Compute the loss and gradients of the model on a minibatch.
+
+    Inputs:
+    - X, y: Minibatch of data and labels as for model.loss
+
+    Returns a tuple of:
+    - loss: The loss on the whole minibatch
+    - grads: Dictionary mapping parameter names to gradients. The arrays are
+      reused by the next call.
+    """
+    for k, v in self.model.params.items():
+      self.params[k][...] = v
+    self.x_spec = self._batch_block(self.x_spec, X)
+    self.y_spec = self._batch_block(self.y_spec, y)
+
+    # Split the minibatch into (at most) num_workers non-empty shards
+    N = X.shape[0]
+    bounds = np.unique(np.linspace(0, N, self.num_workers + 1).astype(int))
+    num_shards = len(bounds) - 1
+    running_averages = _running_averages(self.model)
+    tasks = [(self.x_spec, self.y_spec, shard, bounds[shard],
+              bounds[shard + 1], [self.seed, self.step], running_averages)
+             for shard in range(num_shards)]
+    results = self.pool.map(_shard_loss, tasks, chunksize=1)
+    self.step += 1
+
+    # Average everything, weighting each shard by its number of samples
+    weights = np.diff(bounds) / float(N)
+    loss = float(np.dot(weights, [l for l, _ in results]))
+    for k, g in self.grads.items():
+      shard_grads = self.shard_grads[k][:num_shards].reshape(num_shards, -1)
+      np.dot(weights.astype(g.dtype), shard_grads, out=g.reshape(-1))
+
+    # Sync the running averages of the workers into the model
+    for i, bn_param in enumerate(getattr(self.model, 'bn_params', [])):
+      for key in results[0][1][i]:
+        bn_param[key] = sum(w * averages[i][key]
+                            for w, (_, averages) in zip(weights, results))
+
+    return loss, self.grads
+
+  def _free(self, name):
+    """ Close and unlink the shared block name. """
+    shm, array = self.blocks.pop(name)
+    del array
+    shm.close()
+    shm.unlink()
+
+  def close(self):
+    """ Stop the workers and free the shared memory. """
+    self.pool.terminate()
+    self.pool.join()
+    self.params, self.shard_grads, self.grads = {}, {}, {}
+    self.x_spec = self.y_spec = None
+    for name in list(self.blocks):
+      self._free(name)
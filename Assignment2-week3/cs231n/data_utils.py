@@ -1,73 +1,146 @@
+import hashlib
 import pickle as pickle
 import numpy as np
+import multiprocessing
 import os
+import shutil
 # from scipy.misc import imread
 from imageio import imread
 
-def load_CIFAR_batch(filename):
-  """ load single batch of cifar """
+from cs231n.data_iter import normalize_batch
+from cs231n.model_store import ModelStore
+
+def load_CIFAR_batch(filename, dtype="float"):
+  """ load single batch of cifar; dtype=np.uint8 keeps the raw pixels """
   with open(filename, 'rb') as f:
     datadict = pickle.load(f, encoding='latin1')
     X = datadict['data']
     Y = datadict['labels']
-    X = X.reshape(10000, 3, 32, 32).transpose(0,2,3,1).astype("float")
+    X = X.reshape(10000, 3, 32, 32).transpose(0,2,3,1).astype(dtype)
     Y = np.array(Y)
     return X, Y
 
-def load_CIFAR10(ROOT):
+def load_CIFAR10(ROOT, dtype="float"):
   """ load all of cifar """
   xs = []
   ys = []
   for b in range(1,6):
     f = os.path.join(ROOT, 'data_batch_%d' % (b, ))
-    X, Y = load_CIFAR_batch(f)
+    X, Y = load_CIFAR_batch(f, dtype)
     xs.append(X)
     ys.append(Y)    
   Xtr = np.concatenate(xs)
   Ytr = np.concatenate(ys)
   del X, Y
-  Xte, Yte = load_CIFAR_batch(os.path.join(ROOT, 'test_batch'))
+  Xte, Yte = load_CIFAR_batch(os.path.join(ROOT, 'test_batch'), dtype)
   return Xtr, Ytr, Xte, Yte
 
 
-def get_CIFAR10_data(num_training=49000, num_validation=1000, num_test=1000):
+def _preprocess_CIFAR10(cifar10_dir, num_training, num_validation, num_test,
+                        channels_last, dtype):
+  """
+  Load the raw CIFAR-10 batches and run the preprocessing of
+  get_CIFAR10_data. The mean image is computed and subtracted in float64
+  before the data is converted to dtype; for dtype=np.uint8 the pixels are
+  kept as they are and the mean image is returned with them instead.
+  """
+  raw = np.dtype(dtype) == np.uint8
+  X_train, y_train, X_test, y_test = load_CIFAR10(
+      cifar10_dir, np.uint8 if raw else np.float64)
+
+  # Subsample the data; slices are views, not copies
+  X_val = X_train[num_training:num_training + num_validation]
+  y_val = y_train[num_training:num_training + num_validation]
+  X_train = X_train[:num_training]
+  y_train = y_train[:num_training]
+  X_test = X_test[:num_test]
+  y_test = y_test[:num_test]
+
+  # Normalize the data: subtract the mean image
+  mean_image = np.mean(X_train, axis=0)
+  data = {'y_train': y_train, 'y_val': y_val, 'y_test': y_test}
+  if raw:
+    if not channels_last:
+      mean_image = mean_image.transpose(2, 0, 1)
+    data['mean_image'] = np.ascontiguousarray(mean_image)
+  for name, X in (('X_train', X_train), ('X_val', X_val), ('X_test', X_test)):
+    if not raw:
+      X = X - mean_image
+    # Transpose so that channels come first, converting in the same copy
+    if not channels_last:
+      X = X.transpose(0, 3, 1, 2)
+    data[name] = np.ascontiguousarray(X, dtype=dtype)
+  return data
+
+
+def get_CIFAR10_data(num_training=49000, num_validation=1000, num_test=1000,
+                     channels_last=False, dtype=np.float64,
+                     cache_dir=None, mmap=False):
     """
     Load the CIFAR-10 dataset from disk and perform preprocessing to prepare
     it for classifiers. These are the same steps as we used for the SVM, but
     condensed to a single function.
+
+    If channels_last is True the images are returned in the (N, H, W, C)
+    layout they are stored in, which skips the transpose copies; use this
+    with models built with layout='NHWC'.
+
+    With dtype=np.uint8 the images are the raw pixels, an eighth of the size
+    of float64, and the float64 mean image is returned under 'mean_image'
+    instead of being subtracted; Solver and data_iter.BatchIterator then
+    subtract it per batch (see data_iter.normalize_batch).
+
+    If cache_dir is given (for example 'cs231n/datasets/cifar-10-cache'),
+    the preprocessed arrays are saved as .npy files in a subdirectory of it
+    named after the arguments and the size and modification time of the raw
+    batches, in their final layout and dtype; later calls with the same
+    arguments and batches load them from there instead of unpickling and
+    preprocessing the raw batches again. With a cache and mmap=True they are
+    memory-mapped read-only, so that loading is almost free and processes
+    training on the same data share one copy of it through the page cache;
+    by default they are loaded into writable arrays in memory.
     """
-    # Load the raw CIFAR-10 data
     cifar10_dir = 'cs231n/datasets/cifar-10-batches-py'
-    X_train, y_train, X_test, y_test = load_CIFAR10(cifar10_dir)
-        
-    # Subsample the data
-    mask = list(range(num_training, num_training + num_validation))
-    X_val = X_train[mask]
-    y_val = y_train[mask]
-    mask = list(range(num_training))
-    X_train = X_train[mask]
-    y_train = y_train[mask]
-    mask = list(range(num_test))
-    X_test = X_test[mask]
-    y_test = y_test[mask]
-
-    # Normalize the data: subtract the mean image
-    mean_image = np.mean(X_train, axis=0)
-    X_train -= mean_image
-    X_val -= mean_image
-    X_test -= mean_image
-    
-    # Transpose so that channels come first
-    X_train = X_train.transpose(0, 3, 1, 2).copy()
-    X_val = X_val.transpose(0, 3, 1, 2).copy()
-    X_test = X_test.transpose(0, 3, 1, 2).copy()
-
-    # Package data into a dictionary
-    return {
-      'X_train': X_train, 'y_train': y_train,
-      'X_val': X_val, 'y_val': y_val,
-      'X_test': X_test, 'y_test': y_test,
-    }
+    names = ('X_train', 'y_train', 'X_val', 'y_val', 'X_test', 'y_test')
+    if np.dtype(dtype) == np.uint8:
+      names += ('mean_image',)
+    if cache_dir is None:
+      return _preprocess_CIFAR10(cifar10_dir, num_training, num_validation,
+                                 num_test, channels_last, dtype)
+
+    # Key the cache on the raw batches too, so that changed or re-downloaded
+    # batches are preprocessed again
+    sources = []
+    for name in ['data_batch_%d' % b for b in range(1, 6)] + ['test_batch']:
+      st = os.stat(os.path.join(cifar10_dir, name))
+      sources.append('%s:%d:%d' % (name, st.st_size, st.st_mtime_ns))
+    key = 'train%d_val%d_test%d_%s_%s_%s' % (
+        num_training, num_validation, num_test,
+        'nhwc' if channels_last else 'nchw', np.dtype(dtype).name,
+        hashlib.sha1(','.join(sources).encode()).hexdigest()[:12])
+    path = os.path.join(cache_dir, key)
+    if not os.path.isdir(path):
+      data = _preprocess_CIFAR10(cifar10_dir, num_training, num_validation,
+                                 num_test, channels_last, dtype)
+      # Write into a temporary directory and rename it when complete, so
+      # that an interrupted or concurrent conversion never leaves a partial
+      # cache behind
+      tmp_path = '%s.tmp%d' % (path, os.getpid())
+      os.makedirs(tmp_path)
+      for name in names:
+        np.save(os.path.join(tmp_path, name + '.npy'), data[name])
+      try:
+        os.rename(tmp_path, path)
+      except OSError:
+        # Another process finished first
+        shutil.rmtree(tmp_path)
+      if not mmap:
+        return data
+
+    mmap_mode = 'r' if mmap else None
+    return {name: np.load(os.path.join(path, name + '.npy'),
+                          mmap_mode=mmap_mode)
+            for name in names}
     
 
 def load_tiny_imagenet(path, dtype=np.float32):
@@ -177,11 +250,271 @@ def load_tiny_imagenet(path, dtype=np.float32):
   return class_names, X_train, y_train, X_val, y_val, X_test, y_test
 
 
+def _read_tiny_imagenet_image(filename):
+  """ Read one TinyImageNet image as a (3, 64, 64) uint8 array. """
+  img = imread(filename)
+  if img.ndim == 2:
+    ## grayscale file
+    img = img.reshape(64, 64, 1)
+  return np.broadcast_to(img.transpose(2, 0, 1), (3, 64, 64))
+
+
+def _decode_tiny_imagenet(args):
+  """
+  Decode a list of image files into one packed uint8 .npy file, written to a
+  temporary name first so that an interrupted run leaves no partial file.
+  """
+  filenames, out_file = args
+  X = np.empty((len(filenames), 3, 64, 64), dtype=np.uint8)
+  for i, filename in enumerate(filenames):
+    X[i] = _read_tiny_imagenet_image(filename)
+  tmp_file = '%s.tmp%d.npy' % (out_file, os.getpid())
+  np.save(tmp_file, X)
+  os.replace(tmp_file, out_file)
+  return len(filenames)
+
+
+class TinyImageNet(object):
+  """
+  TinyImageNet (any of TinyImageNet-100-A, TinyImageNet-100-B and
+  TinyImageNet-200), decoded once into packed uint8 .npy files and then
+  served from memory maps.
+
+  The first time a class is used its training and validation images are
+  decoded, by a pool of worker processes, into one file per class and split
+  in cache_dir; the test images go into files of test_chunk_size images.
+  Later runs only memory-map these files, and a subset of the classes never
+  decodes (or reads) the others.
+
+  Example usage:
+
+  data = TinyImageNet('cs231n/datasets/tiny-imagenet-100-A', classes=10)
+  X_val, y_val = data.load('val')  # uint8, (N, 3, 64, 64)
+  mean_image = data.mean_image()
+  for X_batch, y_batch in data.batches('train', 100, mean=mean_image):
+    ...
+  """
+
+  test_chunk_size = 1000
+
+  def __init__(self, path, classes=None, cache_dir=None, num_workers=None,
+               verbose=True):
+    """
+    Open the dataset, decoding whatever the requested classes still need.
+
+    Inputs:
+    - path: String giving path to the directory to load.
+    - classes: None for all the classes; an integer n for the first n; or a
+      list of wnids or of class indices. Labels are positions in this list.
+    - cache_dir: Directory for the packed files; defaults to path + '/packed'.
+    - num_workers: Number of decoding processes; defaults to the CPU count.
+      With 0 or 1 the images are decoded in this process.
+    - verbose: Boolean; if True print what is being decoded.
+    """
+    self.path = path
+    self.cache_dir = cache_dir or os.path.join(path, 'packed')
+
+    # First load wnids
+    with open(os.path.join(path, 'wnids.txt'), 'r') as f:
+      all_wnids = [x.strip() for x in f]
+    if classes is None:
+      self.wnids = all_wnids
+    elif isinstance(classes, int):
+      self.wnids = all_wnids[:classes]
+    else:
+      self.wnids = [all_wnids[c] if isinstance(c, (int, np.integer)) else c
+                    for c in classes]
+    self.wnid_to_label = {wnid: i for i, wnid in enumerate(self.wnids)}
+
+    # Use words.txt to get names for each class
+    with open(os.path.join(path, 'words.txt'), 'r') as f:
+      wnid_to_words = dict(line.split('\t') for line in f)
+    self.class_names = [[w.strip() for w in wnid_to_words[wnid].split(',')]
+                        for wnid in self.wnids]
+
+    tasks = self._missing_files()
+    if tasks:
+      if verbose:
+        print('decoding %d images into %d files in %s' % (
+              sum(len(files) for files, _ in tasks), len(tasks),
+              self.cache_dir))
+      if num_workers is None:
+        num_workers = multiprocessing.cpu_count()
+      if num_workers <= 1 or len(tasks) == 1:
+        for task in tasks:
+          _decode_tiny_imagenet(task)
+      else:
+        self._decode_in_pool(tasks, num_workers)
+
+  def _decode_in_pool(self, tasks, num_workers):
+    # The tasks are plain filenames, so any start method works; fork is
+    # just the cheapest
+    if 'fork' in multiprocessing.get_all_start_methods():
+      context = multiprocessing.get_context('fork')
+    else:
+      context = multiprocessing.get_context()
+    pool = context.Pool(num_workers)
+    try:
+      pool.map(_decode_tiny_imagenet, tasks, chunksize=1)
+    finally:
+      pool.close()
+      pool.join()
+
+  def _class_file(self, split, wnid):
+    return os.path.join(self.cache_dir, split, wnid + '.npy')
+
+  def _val_files(self):
+    """ Dictionary mapping each wnid to its validation image files. """
+    files = {}
+    with open(os.path.join(self.path, 'val', 'val_annotations.txt')) as f:
+      for line in f:
+        img_file, wnid = line.split('\t')[:2]
+        files.setdefault(wnid, []).append(
+            os.path.join(self.path, 'val', 'images', img_file))
+    return files
+
+  def _test_files(self):
+    """
+    The sorted test image names and their wnids (None if there are no test
+    labels, as in student code).
+    """
+    img_files = sorted(os.listdir(os.path.join(self.path, 'test', 'images')))
+    wnids = None
+    y_test_file = os.path.join(self.path, 'test', 'test_annotations.txt')
+    if os.path.isfile(y_test_file):
+      with open(y_test_file, 'r') as f:
+        img_file_to_wnid = dict(line.split('\t')[:2] for line in f)
+      wnids = [img_file_to_wnid[img_file] for img_file in img_files]
+    return img_files, wnids
+
+  def _missing_files(self):
+    """ Returns the decoding tasks for the packed files that do not exist. """
+    tasks = []
+    for split in ('train', 'val', 'test'):
+      if not os.path.isdir(os.path.join(self.path, split)):
+        continue
+      os.makedirs(os.path.join(self.cache_dir, split), exist_ok=True)
+    val_files = None
+    for wnid in self.wnids:
+      out_file = self._class_file('train', wnid)
+      if not os.path.isfile(out_file):
+        # To figure out the filenames we need to open the boxes file
+        train_dir = os.path.join(self.path, 'train', wnid)
+        with open(os.path.join(train_dir, '%s_boxes.txt' % wnid), 'r') as f:
+          filenames = [os.path.join(train_dir, 'images', x.split('\t')[0])
+                       for x in f]
+        tasks.append((filenames, out_file))
+      out_file = self._class_file('val', wnid)
+      if not os.path.isfile(out_file):
+        if val_files is None:
+          val_files = self._val_files()
+        tasks.append((val_files.get(wnid, []), out_file))
+    if os.path.isdir(os.path.join(self.path, 'test', 'images')):
+      img_files = self._test_files()[0]
+      for i, start in enumerate(range(0, len(img_files), self.test_chunk_size)):
+        out_file = os.path.join(self.cache_dir, 'test', 'chunk_%04d.npy' % i)
+        if not os.path.isfile(out_file):
+          filenames = [os.path.join(self.path, 'test', 'images', img_file)
+                       for img_file in
+                       img_files[start:start + self.test_chunk_size]]
+          tasks.append((filenames, out_file))
+    return tasks
+
+  def chunks(self, split):
+    """
+    Returns the memory-mapped packed arrays of a split as a list of
+    (X, y) tuples: one per class for 'train' and 'val', where y is the label,
+    and one per file for 'test', where y is an array of labels (-1 for
+    images of classes that are not loaded) or None without test labels.
+    """
+    if split != 'test':
+      return [(np.load(self._class_file(split, wnid), mmap_mode='r'), label)
+              for label, wnid in enumerate(self.wnids)]
+    img_files, wnids = self._test_files()
+    y = None
+    if wnids is not None:
+      y = np.array([self.wnid_to_label.get(wnid, -1) for wnid in wnids])
+    chunks = []
+    for i, start in enumerate(range(0, len(img_files), self.test_chunk_size)):
+      X = np.load(os.path.join(self.cache_dir, 'test', 'chunk_%04d.npy' % i),
+                  mmap_mode='r')
+      chunks.append((X, None if y is None else
+                        y[start:start + self.test_chunk_size]))
+    return chunks
+
+  def load(self, split):
+    """
+    Returns a split as in-memory arrays X of shape (N, 3, 64, 64) and dtype
+    uint8 and y of shape (N,); for 'test', only the images of the loaded
+    classes if there are test labels, and y is None otherwise.
+    """
+    chunks = self.chunks(split)
+    X = np.concatenate([X for X, _ in chunks])
+    if split != 'test':
+      y = np.concatenate([np.full(X.shape[0], label, dtype=np.int64)
+                          for X, label in chunks])
+      return X, y
+    if chunks[0][1] is None:
+      return X, None
+    y = np.concatenate([y for _, y in chunks])
+    keep = y >= 0
+    return X[keep], y[keep]
+
+  def mean_image(self):
+    """ The float64 mean of the training images, of shape (3, 64, 64). """
+    total = np.zeros((3, 64, 64))
+    count = 0
+    for X, _ in self.chunks('train'):
+      total += X.sum(axis=0, dtype=np.float64)
+      count += X.shape[0]
+    return total / count
+
+  def batches(self, split, batch_size, shuffle=True, mean=None,
+              dtype=np.float32, seed=None):
+    """
+    Stream one epoch of minibatches of a split ('train' or 'val') straight
+    from the memory maps, without loading the whole split.
+
+    Inputs:
+    - split: 'train' or 'val'
+    - batch_size: Number of images per batch
+    - shuffle: If True visit the images in a random order
+    - mean: If not None, batches are normalized with
+      data_iter.normalize_batch to dtype; otherwise they are uint8
+    - dtype: dtype of the normalized batches
+    - seed: Optional seed for the shuffling
+
+    Yields tuples (X_batch, y_batch).
+    """
+    chunks = self.chunks(split)
+    sizes = [X.shape[0] for X, _ in chunks]
+    offsets = np.concatenate([[0], np.cumsum(sizes)])
+    labels = np.array([label for _, label in chunks])
+    N = offsets[-1]
+    order = np.arange(N)
+    if shuffle:
+      order = np.random.RandomState(seed).permutation(N)
+    for start in range(0, N, batch_size):
+      # Sorted indices read each memory map forwards
+      idx = np.sort(order[start:start + batch_size])
+      chunk_idx = np.searchsorted(offsets, idx, side='right') - 1
+      X_batch = np.empty((len(idx), 3, 64, 64), dtype=np.uint8)
+      for c in np.unique(chunk_idx):
+        rows = chunk_idx == c
+        X_batch[rows] = chunks[c][0][idx[rows] - offsets[c]]
+      y_batch = labels[chunk_idx]
+      if mean is not None:
+        X_batch = normalize_batch(X_batch, mean, dtype)
+      yield X_batch, y_batch
+
+
 def load_models(models_dir):
   """
   Load saved models from disk. This will attempt to unpickle all files in a
-  directory; any files that give errors on unpickling (such as README.txt) will
-  be skipped.
+  directory that start like a pickle; other files (such as README.txt) are
+  skipped after reading their first byte, as are files that still give errors
+  on unpickling. If the directory is a model_store.ModelStore, its models are
+  loaded too; see ModelStore to list or compare models without loading them.
 
   Inputs:
   - models_dir: String giving the path to a directory containing model files.
@@ -192,9 +525,21 @@ def load_models(models_dir):
   """
   models = {}
   for model_file in os.listdir(models_dir):
-    with open(os.path.join(models_dir, model_file), 'rb') as f:
+    path = os.path.join(models_dir, model_file)
+    if not os.path.isfile(path):
+      continue
+    with open(path, 'rb') as f:
+      # Protocol 2 and later start with PROTO; older dict pickles with ( or }
+      if f.read(1) not in (b'\x80', b'(', b'}'):
+        continue
+      f.seek(0)
       try:
         models[model_file] = pickle.load(f)['model']
       except pickle.UnpicklingError:
         continue
+  if os.path.exists(os.path.join(models_dir, 'manifest.json')):
+    store = ModelStore(models_dir)
+    for name in store.names():
+      if store.info(name)['class'] is not None:
+        models[name] = store.load(name)
   return models
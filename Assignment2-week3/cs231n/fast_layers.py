@@ -2,13 +2,39 @@ import numpy as np
 try:
   from cs231n.im2col_cython import col2im_cython, im2col_cython
   from cs231n.im2col_cython import col2im_6d_cython
+  have_im2col_cython = True
 except ImportError:
-  print('run the following from the cs231n directory and try again:')
+  have_im2col_cython = False
+  print('The Cython im2col kernels are not compiled; falling back to the much')
+  print('slower im2col.py. Run the following from the cs231n directory:')
   print('python setup.py build_ext --inplace')
   print('You may also need to restart your iPython kernel')
 
+# scipy.fft is faster than numpy.fft, keeps float32 inputs in single precision
+# and can round transform sizes up to fast lengths; numpy.fft works too.
+try:
+  from scipy import fft as fftpack
+  from scipy.fft import next_fast_len
+except ImportError:
+  fftpack = np.fft
+  next_fast_len = lambda n, real=True: n
+
 from cs231n.im2col import *
 
+if not have_im2col_cython:
+  def im2col_cython(x, field_height, field_width, padding, stride):
+    return im2col_indices(x, field_height, field_width, padding, stride)
+
+  def col2im_cython(cols, N, C, H, W, field_height, field_width, padding,
+                    stride):
+    out_height = (H + 2 * padding - field_height) // stride + 1
+    out_width = (W + 2 * padding - field_width) // stride + 1
+    cols = cols.reshape(C, field_height, field_width, out_height, out_width, N)
+    return col2im_6d(cols.transpose(0, 1, 2, 5, 3, 4), N, C, H, W,
+                     field_height, field_width, padding, stride)
+
+  col2im_6d_cython = col2im_6d
+
 
 def conv_forward_im2col(x, w, b, conv_param):
   """
@@ -17,15 +43,15 @@ def conv_forward_im2col(x, w, b, conv_param):
   """
   N, C, H, W = x.shape
   num_filters, _, filter_height, filter_width = w.shape
-  stride, pad = conv_param['stride'], conv_param['pad']
+  stride, pad = conv_param['stride'], int(conv_param['pad'])
 
   # Check dimensions
   assert (W + 2 * pad - filter_width) % stride == 0, 'width does not work'
   assert (H + 2 * pad - filter_height) % stride == 0, 'height does not work'
 
   # Create output
-  out_height = (H + 2 * pad - filter_height) / stride + 1
-  out_width = (W + 2 * pad - filter_width) / stride + 1
+  out_height = (H + 2 * pad - filter_height) // stride + 1
+  out_width = (W + 2 * pad - filter_width) // stride + 1
   out = np.zeros((N, num_filters, out_height, out_width), dtype=x.dtype)
 
   # x_cols = im2col_indices(x, w.shape[2], w.shape[3], pad, stride)
@@ -39,6 +65,22 @@ def conv_forward_im2col(x, w, b, conv_param):
   return out, cache
 
 
+def strided_cols(x_padded, HH, WW, stride, out_h, out_w):
+  """
+  Build the (C * HH * WW, N * out_h * out_w) im2col matrix of an already
+  padded input by picking clever strides, with a single contiguous copy.
+  """
+  N, C, H, W = x_padded.shape
+  shape = (C, HH, WW, N, out_h, out_w)
+  strides = (H * W, W, 1, C * H * W, stride * W, stride)
+  strides = x_padded.itemsize * np.array(strides)
+  x_stride = np.lib.stride_tricks.as_strided(x_padded,
+                shape=shape, strides=strides)
+  x_cols = np.ascontiguousarray(x_stride)
+  x_cols.shape = (C * HH * WW, N * out_h * out_w)
+  return x_cols
+
+
 def conv_forward_strides(x, w, b, conv_param):
   N, C, H, W = x.shape
   F, _, HH, WW = w.shape
@@ -69,13 +111,7 @@ def conv_forward_strides(x, w, b, conv_param):
   stride = int(stride)
 
   # Perform an im2col operation by picking clever strides
-  shape = (C, HH, WW, N, out_h, out_w)
-  strides = (H * W, W, 1, C * H * W, stride * W, stride)
-  strides = x.itemsize * np.array(strides)
-  x_stride = np.lib.stride_tricks.as_strided(x_padded,
-                shape=shape, strides=strides)
-  x_cols = np.ascontiguousarray(x_stride)
-  x_cols.shape = (C * HH * WW, N * out_h * out_w)
+  x_cols = strided_cols(x_padded, HH, WW, stride, out_h, out_w)
 
   # Now all our convolutions are a big matrix multiply
   res = w.reshape(F, -1).dot(x_cols) + b.reshape(-1, 1)
@@ -113,13 +149,84 @@ def conv_backward_strides(dout, cache):
   return dx, dw, db
 
 
+def conv_forward_tiled(x, w, b, conv_param):
+  """
+  A memory-bounded version of conv_forward_strides.
+
+  The batch is processed in chunks of conv_param['tile_size'] images, so the
+  x_cols matrix only ever holds the columns of one chunk. The columns are not
+  cached; the backward pass rebuilds them chunk by chunk instead, so the peak
+  memory of the layer scales with the tile size rather than the batch size.
+  """
+  N, C, H, W = x.shape
+  F, _, HH, WW = w.shape
+  stride, pad = int(conv_param['stride']), int(conv_param['pad'])
+  tile_size = int(conv_param.get('tile_size', N))
+
+  # Check dimensions
+  assert (W + 2 * pad - WW) % stride == 0, 'width does not work'
+  assert (H + 2 * pad - HH) % stride == 0, 'height does not work'
+
+  out_h = (H + 2 * pad - HH) // stride + 1
+  out_w = (W + 2 * pad - WW) // stride + 1
+  out = np.empty((N, F, out_h, out_w), dtype=x.dtype)
+
+  w_reshaped = w.reshape(F, -1)
+  for start in range(0, N, tile_size):
+    x_tile = x[start:start + tile_size]
+    n = x_tile.shape[0]
+    x_padded = np.pad(x_tile, ((0, 0), (0, 0), (pad, pad), (pad, pad)),
+                      mode='constant')
+    x_cols = strided_cols(x_padded, HH, WW, stride, out_h, out_w)
+    res = w_reshaped.dot(x_cols) + b.reshape(-1, 1)
+    out[start:start + n] = res.reshape(F, n, out_h, out_w).transpose(1, 0, 2, 3)
+
+  cache = (x, w, b, conv_param)
+  return out, cache
+
+
+def conv_backward_tiled(dout, cache):
+  """
+  Backward pass for conv_forward_tiled, rebuilding the columns of one chunk
+  of the batch at a time.
+  """
+  x, w, b, conv_param = cache
+  N, C, H, W = x.shape
+  F, _, HH, WW = w.shape
+  _, _, out_h, out_w = dout.shape
+  stride, pad = int(conv_param['stride']), int(conv_param['pad'])
+  tile_size = int(conv_param.get('tile_size', N))
+
+  db = np.sum(dout, axis=(0, 2, 3))
+  dw = np.zeros((F, C * HH * WW), dtype=w.dtype)
+  dx = np.empty_like(x)
+
+  w_reshaped = w.reshape(F, -1)
+  for start in range(0, N, tile_size):
+    x_tile = x[start:start + tile_size]
+    n = x_tile.shape[0]
+    x_padded = np.pad(x_tile, ((0, 0), (0, 0), (pad, pad), (pad, pad)),
+                      mode='constant')
+    x_cols = strided_cols(x_padded, HH, WW, stride, out_h, out_w)
+
+    dout_reshaped = dout[start:start + n].transpose(1, 0, 2, 3).reshape(F, -1)
+    dw += dout_reshaped.dot(x_cols.T)
+
+    dx_cols = w_reshaped.T.dot(dout_reshaped)
+    dx_cols.shape = (C, HH, WW, n, out_h, out_w)
+    dx[start:start + n] = col2im_6d_cython(dx_cols, n, C, H, W, HH, WW,
+                                           pad, stride)
+
+  return dx, dw.reshape(w.shape), db
+
+
 def conv_backward_im2col(dout, cache):
   """
   A fast implementation of the backward pass for a convolutional layer
   based on im2col and col2im.
   """
   x, w, b, conv_param, x_cols = cache
-  stride, pad = conv_param['stride'], conv_param['pad']
+  stride, pad = conv_param['stride'], int(conv_param['pad'])
 
   db = np.sum(dout, axis=(0, 2, 3))
 
@@ -135,46 +242,509 @@ def conv_backward_im2col(dout, cache):
   return dx, dw, db
 
 
-conv_forward_fast = conv_forward_strides
-conv_backward_fast = conv_backward_strides
+# Winograd F(2x2, 3x3) filter transform; see Lavin & Gray, "Fast Algorithms
+# for Convolutional Neural Networks". Each 2x2 output tile is computed from a
+# 4x4 input tile with 16 multiplies instead of 36. The input transform B^T and
+# the output transform A^T only contain 0 and +-1, so they are applied below
+# as additions on strided views rather than as matrix products:
+#
+#   B^T = [[1,  0, -1,  0],     A^T = [[1, 1,  1,  0],
+#          [0,  1,  1,  0],            [0, 1, -1, -1]]
+#          [0, -1,  1,  0],
+#          [0,  1,  0, -1]]
+#
+# All Winograd-domain arrays are laid out as (4, 4, channels, tiles_h,
+# tiles_w, N): with N innermost every transform works on long contiguous runs,
+# and the array reshapes to (16, channels, P) for the matrix products.
+WINOGRAD_G = np.array([[1, 0, 0],
+                       [0.5, 0.5, 0.5],
+                       [0.5, -0.5, 0.5],
+                       [0, 0, 1]])
 
 
-def max_pool_forward_fast(x, pool_param):
+def _winograd_input_transform(x, pad, tiles_h, tiles_w):
   """
-  A fast implementation of the forward pass for a max pooling layer.
+  Cut the zero-padded input into overlapping 4x4 tiles with a step of 2 and
+  apply B^T d B to each of them, returning V of shape
+  (4, 4, C, tiles_h, tiles_w, N).
+  """
+  N, C, H, W = x.shape
+
+  # Zero-pad into a (C, H, W, N) buffer, with extra rows / columns on the
+  # bottom / right so that the output splits into whole tiles. Columns are
+  # stored de-interleaved by parity, as (2, tiles_w + 1), so that column c of
+  # every tile is the slice [:, :, c % 2, c // 2:].
+  x_padded = np.zeros((C, 2 * tiles_h + 2, 2, tiles_w + 1, N), dtype=x.dtype)
+  x_t = x.transpose(1, 2, 3, 0)
+  for parity in range(2):
+    start = (parity - pad) % 2
+    k = (pad + start) // 2
+    x_cols = x_t[:, :, start::2]
+    x_padded[:, pad:pad + H, parity, k:k + x_cols.shape[2]] = x_cols
+
+  def transform(d, out):
+    np.subtract(d[0], d[2], out=out[0])
+    np.add(d[1], d[2], out=out[1])
+    np.subtract(d[2], d[1], out=out[2])
+    np.subtract(d[1], d[3], out=out[3])
 
-  This chooses between the reshape method and the im2col method. If the pooling
-  regions are square and tile the input image, then we can use the reshape
-  method which is very fast. Otherwise we fall back on the im2col method, which
-  is not much faster than the naive method.
+  # B^T d B as two passes of additions: first over tile rows, then columns
+  rows = [x_padded[:, a:a + 2 * tiles_h:2] for a in range(4)]
+  t = np.empty((4, C, tiles_h, 2, tiles_w + 1, N), dtype=x.dtype)
+  transform(rows, t)
+  V = np.empty((4, 4, C, tiles_h, tiles_w, N), dtype=x.dtype)
+  for a in range(4):
+    transform([t[a][:, :, c % 2, c // 2:c // 2 + tiles_w] for c in range(4)],
+              V[a])
+  return V
+
+
+def _winograd_input_transform_backward(dV, pad, H, W):
+  """
+  Backward pass of _winograd_input_transform: apply B dV B^T to each tile and
+  scatter-add the overlapping tiles back into an (N, C, H, W) gradient.
+  """
+  _, _, C, tiles_h, tiles_w, N = dV.shape
+
+  # B dV B^T as two passes of additions: first over tile columns, then rows
+  def transform(d):
+    return [d[0], d[1] - d[2] + d[3], d[1] + d[2] - d[0], -d[3]]
+
+  dt = [transform(dV[a]) for a in range(4)]
+
+  # dx_padded[c, 2I + ra, 2J + cb, n] is stored as D[c, I, ra, J, cb, n], so
+  # element (a, c) of tile (i, j) lands in D[:, i + a // 2, a % 2,
+  # j + c // 2, c % 2] and every scatter is a slice.
+  D = np.zeros((C, tiles_h + 1, 2, tiles_w + 1, 2, N), dtype=dV.dtype)
+  for c in range(4):
+    column = transform([dt[a][c] for a in range(4)])
+    for a in range(4):
+      D[:, a // 2:a // 2 + tiles_h, a % 2,
+        c // 2:c // 2 + tiles_w, c % 2] += column[a]
+  D = D.reshape(C, 2 * tiles_h + 2, 2 * tiles_w + 2, N)
+  dx = D[:, pad:pad + H, pad:pad + W].transpose(3, 0, 1, 2)
+  return np.ascontiguousarray(dx)
+
+
+def _winograd_output_transform(M, out_h, out_w):
+  """
+  Apply A^T m A to every tile of M, of shape (4, 4, F, tiles_h, tiles_w, N),
+  and stitch the 2x2 results into an (N, F, out_h, out_w) array.
+  """
+  _, _, F, tiles_h, tiles_w, N = M.shape
+  s = [M[0] + M[1] + M[2], M[1] - M[2] - M[3]]
+  out = np.empty((F, 2 * tiles_h, 2 * tiles_w, N), dtype=M.dtype)
+  for a in range(2):
+    np.add(s[a][0] + s[a][1], s[a][2], out=out[:, a::2, 0::2])
+    np.subtract(s[a][1] - s[a][2], s[a][3], out=out[:, a::2, 1::2])
+  out = out[:, :out_h, :out_w].transpose(3, 0, 1, 2)
+  return np.ascontiguousarray(out)
+
+
+def _winograd_output_transform_backward(dout, tiles_h, tiles_w):
+  """
+  Backward pass of _winograd_output_transform: apply A dy A^T to every 2x2
+  tile of dout, returning dM of shape (4, 4, F, tiles_h, tiles_w, N).
+  """
+  N, F, out_h, out_w = dout.shape
+  dout_t = np.zeros((F, 2 * tiles_h, 2 * tiles_w, N), dtype=dout.dtype)
+  dout_t[:, :out_h, :out_w] = dout.transpose(1, 2, 3, 0)
+
+  def transform(y):
+    return [y[0], y[0] + y[1], y[0] - y[1], -y[1]]
+
+  rows = transform([dout_t[:, 0::2], dout_t[:, 1::2]])
+  dM = np.empty((4, 4, F, tiles_h, tiles_w, N), dtype=dout.dtype)
+  for a in range(4):
+    cols = transform([rows[a][:, :, 0::2], rows[a][:, :, 1::2]])
+    for c in range(4):
+      dM[a, c] = cols[c]
+  return dM
+
+
+def conv_forward_winograd(x, w, b, conv_param):
+  """
+  A fast implementation of the forward pass for a convolutional layer with
+  3x3 filters and stride 1, based on Winograd F(2x2, 3x3).
+
+  Unlike conv_forward_strides this never builds the (C * 9, N * H' * W')
+  x_cols matrix, and the cache only holds the layer inputs.
   """
   N, C, H, W = x.shape
-  pool_height, pool_width = pool_param['pool_height'], pool_param['pool_width']
-  stride = pool_param['stride']
+  F, _, HH, WW = w.shape
+  stride, pad = conv_param['stride'], int(conv_param['pad'])
+  assert HH == WW == 3 and stride == 1, 'Winograd needs 3x3 stride 1 filters'
 
-  same_size = pool_height == pool_width == stride
-  tiles = H % pool_height == 0 and W % pool_width == 0
-  if same_size and tiles:
-    out, reshape_cache = max_pool_forward_reshape(x, pool_param)
-    cache = ('reshape', reshape_cache)
-  else:
-    out, im2col_cache = max_pool_forward_im2col(x, pool_param)
-    cache = ('im2col', im2col_cache)
+  out_h, out_w = H + 2 * pad - 2, W + 2 * pad - 2
+  tiles_h, tiles_w = (out_h + 1) // 2, (out_w + 1) // 2
+
+  # Filter transform G g G^T, then 16 independent (F, C) x (C, P) products
+  G = WINOGRAD_G.astype(w.dtype)
+  U = np.matmul(np.matmul(G, w), G.T).transpose(2, 3, 0, 1).reshape(16, F, C)
+  V = _winograd_input_transform(x, pad, tiles_h, tiles_w)
+  M = np.matmul(U, V.reshape(16, C, -1))
+  M = M.reshape(4, 4, F, tiles_h, tiles_w, N)
+
+  out = _winograd_output_transform(M, out_h, out_w)
+  out += b.reshape(1, -1, 1, 1)
+
+  cache = (x, w, b, conv_param)
   return out, cache
 
 
+def conv_backward_winograd(dout, cache):
+  """
+  Backward pass for conv_forward_winograd.
+
+  The gradients are computed in the Winograd domain as well: dout is mapped
+  to dM with A^T, after which dU and dV are 16 independent matrix products
+  each. The input transform is recomputed rather than cached.
+  """
+  x, w, b, conv_param = cache
+  pad = int(conv_param['pad'])
+  N, C, H, W = x.shape
+  F = w.shape[0]
+  _, _, out_h, out_w = dout.shape
+  tiles_h, tiles_w = (out_h + 1) // 2, (out_w + 1) // 2
+
+  db = np.sum(dout, axis=(0, 2, 3))
+
+  G = WINOGRAD_G.astype(w.dtype)
+  U = np.matmul(np.matmul(G, w), G.T).transpose(2, 3, 0, 1).reshape(16, F, C)
+  V = _winograd_input_transform(x, pad, tiles_h, tiles_w).reshape(16, C, -1)
+  dM = _winograd_output_transform_backward(dout, tiles_h, tiles_w)
+  dM = dM.reshape(16, F, -1)
+
+  dU = np.matmul(dM, V.transpose(0, 2, 1))
+  dU = dU.reshape(4, 4, F, C).transpose(2, 3, 0, 1)
+  dw = np.matmul(np.matmul(G.T, dU), G)
+
+  dV = np.matmul(U.transpose(0, 2, 1), dM)
+  dV = dV.reshape(4, 4, C, tiles_h, tiles_w, N)
+  dx = _winograd_input_transform_backward(dV, pad, H, W)
+
+  return dx, dw, db
+
+
+def conv_forward_fft(x, w, b, conv_param):
+  """
+  A fast implementation of the forward pass for a convolutional layer based on
+  the FFT, for large filters.
+
+  Each padded input plane is correlated with each filter as a pointwise
+  product in the frequency domain; the sum over input channels is a
+  (N, C) x (C, F) matrix product per frequency. The cost does not depend on
+  the filter size, but strided layers compute every output position and then
+  subsample.
+  """
+  N, C, H, W = x.shape
+  F, _, HH, WW = w.shape
+  stride, pad = conv_param['stride'], int(conv_param['pad'])
+
+  # Check dimensions
+  assert (W + 2 * pad - WW) % stride == 0, 'width does not work'
+  assert (H + 2 * pad - HH) % stride == 0, 'height does not work'
+
+  x_padded = np.pad(x, ((0, 0), (0, 0), (pad, pad), (pad, pad)),
+                    mode='constant')
+  H_padded, W_padded = H + 2 * pad, W + 2 * pad
+  out_h = (H_padded - HH) // stride + 1
+  out_w = (W_padded - WW) // stride + 1
+
+  # A circular correlation of size at least (H_padded, W_padded) never wraps
+  # around for the valid output positions, so no extra padding is needed.
+  s = (next_fast_len(H_padded, True), next_fast_len(W_padded, True))
+  x_freq = fftpack.rfft2(x_padded, s=s).transpose(2, 3, 0, 1)
+  w_freq = fftpack.rfft2(w, s=s).transpose(2, 3, 1, 0)
+
+  out_freq = np.matmul(x_freq, w_freq.conj()).transpose(2, 3, 0, 1)
+  out = fftpack.irfft2(out_freq, s=s)
+  out = out[:, :, :out_h * stride:stride, :out_w * stride:stride]
+  out = out.astype(x.dtype) + b.reshape(1, -1, 1, 1)
+
+  cache = (x, w, b, conv_param, s, x_freq, w_freq)
+  return out, cache
+
+
+def conv_backward_fft(dout, cache):
+  """
+  Backward pass for conv_forward_fft.
+
+  dout is scattered onto the stride grid of a zero plane; dx is then a
+  convolution of that plane with the filters and dw a correlation of it with
+  the cached input spectra.
+  """
+  x, w, b, conv_param, s, x_freq, w_freq = cache
+  stride, pad = conv_param['stride'], int(conv_param['pad'])
+  N, C, H, W = x.shape
+  F, _, HH, WW = w.shape
+  _, _, out_h, out_w = dout.shape
+
+  db = np.sum(dout, axis=(0, 2, 3))
+
+  dout_plane = np.zeros((N, F) + s, dtype=dout.dtype)
+  dout_plane[:, :, :out_h * stride:stride, :out_w * stride:stride] = dout
+  dout_freq = fftpack.rfft2(dout_plane).transpose(2, 3, 0, 1)
+
+  dx_freq = np.matmul(dout_freq, w_freq.transpose(0, 1, 3, 2))
+  dx = fftpack.irfft2(dx_freq.transpose(2, 3, 0, 1), s=s)
+  dx = dx[:, :, pad:pad + H, pad:pad + W].astype(x.dtype)
+
+  dw_freq = np.matmul(dout_freq.conj().transpose(0, 1, 3, 2), x_freq)
+  dw = fftpack.irfft2(dw_freq.transpose(2, 3, 0, 1), s=s)
+  dw = dw[:, :, :HH, :WW].astype(w.dtype)
+
+  return dx, dw, db
+
+
+def conv_forward_nhwc(x, w, b, conv_param):
+  """
+  A fast implementation of the forward pass for a convolutional layer on
+  channels-last data.
+
+  Inputs:
+  - x: Input data of shape (N, H, W, C)
+  - w: Filter weights of shape (F, C, HH, WW), as for the other methods
+  - b: Biases, of shape (F,)
+  - conv_param: Dictionary with the 'stride' and 'pad' keys
+
+  Returns a tuple of:
+  - out: Output data of shape (N, H', W', F)
+  - cache: (x, w, b, conv_param, x_cols)
+
+  With the channels last every receptive field is a run of (HH, WW, C)
+  values, so x_cols is built with one strided copy as an (N * H' * W',
+  HH * WW * C) matrix, and the product with the filters already is the
+  output in channels-last order without any transpose.
+  """
+  N, H, W, C = x.shape
+  F, _, HH, WW = w.shape
+  stride, pad = int(conv_param['stride']), int(conv_param['pad'])
+
+  # Check dimensions
+  assert (W + 2 * pad - WW) % stride == 0, 'width does not work'
+  assert (H + 2 * pad - HH) % stride == 0, 'height does not work'
+
+  x_padded = np.pad(x, ((0, 0), (pad, pad), (pad, pad), (0, 0)),
+                    mode='constant')
+  out_h = (H + 2 * pad - HH) // stride + 1
+  out_w = (W + 2 * pad - WW) // stride + 1
+
+  s = x_padded.strides
+  x_stride = np.lib.stride_tricks.as_strided(x_padded,
+                shape=(N, out_h, out_w, HH, WW, C),
+                strides=(s[0], stride * s[1], stride * s[2], s[1], s[2], s[3]))
+  x_cols = np.ascontiguousarray(x_stride)
+  x_cols.shape = (N * out_h * out_w, HH * WW * C)
+
+  w_reshaped = w.transpose(2, 3, 1, 0).reshape(-1, F)
+  out = x_cols.dot(w_reshaped) + b
+  out.shape = (N, out_h, out_w, F)
+
+  cache = (x, w, b, conv_param, x_cols)
+  return out, cache
+
+
+def conv_backward_nhwc(dout, cache):
+  """
+  Backward pass for conv_forward_nhwc; dout has shape (N, H', W', F).
+
+  The columns are folded back into the padded input with one strided add
+  per kernel offset.
+  """
+  x, w, b, conv_param, x_cols = cache
+  N, H, W, C = x.shape
+  F, _, HH, WW = w.shape
+  _, out_h, out_w, _ = dout.shape
+  stride, pad = int(conv_param['stride']), int(conv_param['pad'])
+
+  dout_reshaped = dout.reshape(-1, F)
+  db = np.sum(dout_reshaped, axis=0)
+
+  w_reshaped = w.transpose(2, 3, 1, 0).reshape(-1, F)
+  dw = x_cols.T.dot(dout_reshaped).reshape(HH, WW, C, F).transpose(3, 2, 0, 1)
+
+  dx_cols = dout_reshaped.dot(w_reshaped.T)
+  dx_cols.shape = (N, out_h, out_w, HH, WW, C)
+  dx_padded = np.zeros((N, H + 2 * pad, W + 2 * pad, C), dtype=x.dtype)
+  for i in range(HH):
+    for j in range(WW):
+      dx_padded[:, i:i + stride * out_h:stride,
+                j:j + stride * out_w:stride] += dx_cols[:, :, :, i, j]
+  dx = dx_padded[:, pad:pad + H, pad:pad + W]
+
+  return dx, np.ascontiguousarray(dw), db
+
+
+def conv_cost(x_shape, w_shape, conv_param, backward=True):
+  """
+  Estimate the cost of a forward and backward pass through a convolutional
+  layer for each method in conv_methods, or of just the forward pass.
+
+  The model counts, for each method, the multiply-adds of its matrix
+  products, the elements of the intermediate arrays it builds, and the
+  elements of the layer input and output, and weights them with
+  conv_cost_weights. Only the relative values are meaningful.
+
+  Inputs:
+  - x_shape: Shape (N, C, H, W) of the input
+  - w_shape: Shape (F, C, HH, WW) of the filters
+  - conv_param: Dictionary with the 'stride' and 'pad' keys
+  - backward: If False, estimate the cost of the forward pass alone, which
+    does one of the three matrix products and about half of the
+    intermediate arrays
+
+  Returns:
+  - costs: Dictionary mapping the name of every method that can handle this
+    layer to its estimated cost
+  """
+  N, C, H, W = x_shape
+  F, _, HH, WW = w_shape
+  stride, pad = conv_param['stride'], int(conv_param['pad'])
+  H_padded, W_padded = H + 2 * pad, W + 2 * pad
+  out_h = (H_padded - HH) // stride + 1
+  out_w = (W_padded - WW) // stride + 1
+  io = N * C * H * W + N * F * out_h * out_w
+
+  terms = {}
+
+  # im2col: a (F, C * HH * WW) x (C * HH * WW, P) product in the forward pass
+  # and two more of the same size in the backward pass, plus building and
+  # scattering back the x_cols matrix.
+  cols = C * HH * WW * N * out_h * out_w
+  terms['strides'] = (3 * F * cols, cols)
+  if have_im2col_cython:
+    terms['im2col'] = terms['strides']
+
+  # Winograd: 3 x 16 products for 2x2 output tiles, plus transforms that touch
+  # 16 values per tile for every input and output channel.
+  if HH == WW == 3 and stride == 1:
+    tiles = N * ((out_h + 1) // 2) * ((out_w + 1) // 2)
+    terms['winograd'] = (3 * 16 * F * C * tiles, 16 * (C + F) * tiles)
+
+  # FFT: 3 complex (N, C) x (C, F) products per frequency, plus one transform
+  # per input plane, filter and output plane in each direction. This does not
+  # depend on the filter size, but does not benefit from the stride either.
+  fft_h = next_fast_len(H_padded, True)
+  fft_w = next_fast_len(W_padded, True)
+  size = fft_h * fft_w
+  freqs = fft_h * (fft_w // 2 + 1)
+  planes = N * C + F * C + N * F
+  terms['fft'] = (4 * 3 * N * C * F * freqs,
+                  2 * planes * size * np.log2(size))
+
+  costs = {}
+  for method, (macs, elements) in terms.items():
+    if not backward:
+      macs, elements = macs / 3.0, elements / 2.0
+    mac_weight, element_weight, io_weight = conv_cost_weights[method]
+    costs[method] = (mac_weight * macs + element_weight * elements +
+                     io_weight * io)
+  return costs
+
+
+def conv_forward_fast(x, w, b, conv_param):
+  """
+  A fast implementation of the forward pass for a convolutional layer.
+
+  This picks the method in conv_methods with the lowest estimated cost
+  according to conv_cost; setting conv_param['method'] to one of its keys
+  overrides the choice. If conv_param has a 'tile_size' key and an im2col
+  based method is picked, the tiled method is used instead so that the
+  columns of at most tile_size images are alive at any time.
+
+  If conv_param['layout'] is 'NHWC', x and out are channels-last arrays of
+  shape (N, H, W, C) and (N, H', W', F) and the nhwc method is always used.
+  """
+  method = conv_param.get('method')
+  if conv_param.get('layout', 'NCHW') == 'NHWC':
+    method = 'nhwc'
+  elif method is None:
+    costs = conv_cost(x.shape, w.shape, conv_param)
+    method = min(costs, key=costs.get)
+    if 'tile_size' in conv_param and method in ('strides', 'im2col'):
+      method = 'tiled'
+  if method not in conv_methods:
+    raise ValueError('Unrecognized method "%s"' % method)
+
+  forward, _ = conv_methods[method]
+  out, real_cache = forward(x, w, b, conv_param)
+  cache = (method, real_cache)
+  return out, cache
+
+
+def conv_backward_fast(dout, cache):
+  """
+  A fast implementation of the backward pass for a convolutional layer.
+
+  This switches between the methods in conv_methods depending on which
+  method was used to generate the cache.
+  """
+  method, real_cache = cache
+  if method not in conv_methods:
+    raise ValueError('Unrecognized method "%s"' % method)
+  _, backward = conv_methods[method]
+  return backward(dout, real_cache)
+
+
+conv_methods = {
+  'strides': (conv_forward_strides, conv_backward_strides),
+  'tiled': (conv_forward_tiled, conv_backward_tiled),
+  'im2col': (conv_forward_im2col, conv_backward_im2col),
+  'winograd': (conv_forward_winograd, conv_backward_winograd),
+  'fft': (conv_forward_fft, conv_backward_fft),
+  'nhwc': (conv_forward_nhwc, conv_backward_nhwc),
+}
+
+# Weights of the (multiply-adds, intermediate elements, input / output
+# elements) terms of conv_cost, in units of one multiply-add of the strides
+# method. These were fit to the timings of Benchmarks.py for float32 data on
+# a single core; the im2col gather and the small Winograd and complex
+# products are less efficient than one big real matrix product.
+conv_cost_weights = {
+  'strides': (1.0, 230.0, 100.0),
+  'im2col': (1.1, 225.0, 105.0),
+  'winograd': (2.2, 217.0, 54.0),
+  'fft': (2.3, 36.0, 160.0),
+}
+
+
+def max_pool_forward_fast(x, pool_param):
+  """
+  A fast implementation of the forward pass for a max pooling layer.
+
+  This uses the strided method (pool_forward_strided), which handles any
+  window and stride and whose argmax-index backward pass is faster than
+  that of the reshape method even when the pooling regions tile the input.
+  The reshape and im2col methods are kept for comparison.
+
+  If pool_param['layout'] is 'NHWC', x is a channels-last array of shape
+  (N, H, W, C) and the nhwc method is used.
+  """
+  if pool_param.get('layout', 'NCHW') == 'NHWC':
+    out, nhwc_cache = max_pool_forward_nhwc(x, pool_param)
+    return out, ('nhwc', nhwc_cache)
+
+  out, strided_cache = pool_forward_strided(x, dict(pool_param, mode='max'))
+  return out, ('strided', strided_cache)
+
+
 def max_pool_backward_fast(dout, cache):
   """
   A fast implementation of the backward pass for a max pooling layer.
 
-  This switches between the reshape method an the im2col method depending on
-  which method was used to generate the cache.
+  This switches between the strided, reshape, im2col and nhwc methods
+  depending on which method was used to generate the cache.
   """
   method, real_cache = cache
-  if method == 'reshape':
+  if method == 'strided':
+    return pool_backward_strided(dout, real_cache)
+  elif method == 'reshape':
     return max_pool_backward_reshape(dout, real_cache)
   elif method == 'im2col':
     return max_pool_backward_im2col(dout, real_cache)
+  elif method == 'nhwc':
+    return max_pool_backward_nhwc(dout, real_cache)
   else:
     raise ValueError('Unrecognized method "%s"' % method)
 
@@ -245,11 +815,12 @@ def max_pool_forward_im2col(x, pool_param):
   assert (H - pool_height) % stride == 0, 'Invalid height'
   assert (W - pool_width) % stride == 0, 'Invalid width'
 
-  out_height = (H - pool_height) / stride + 1
-  out_width = (W - pool_width) / stride + 1
+  out_height = (H - pool_height) // stride + 1
+  out_width = (W - pool_width) // stride + 1
 
   x_split = x.reshape(N * C, 1, H, W)
-  x_cols = im2col(x_split, pool_height, pool_width, padding=0, stride=stride)
+  x_cols = im2col_indices(x_split, pool_height, pool_width, padding=0,
+                          stride=stride)
   x_cols_argmax = np.argmax(x_cols, axis=0)
   x_cols_max = x_cols[x_cols_argmax, np.arange(x_cols.shape[1])]
   out = x_cols_max.reshape(out_height, out_width, N, C).transpose(2, 3, 0, 1)
@@ -278,3 +849,256 @@ def max_pool_backward_im2col(dout, cache):
   dx = dx.reshape(x.shape)
 
   return dx
+
+
+def pool_windows(x, pool_height, pool_width, stride):
+  """
+  Returns a read-only strided view of shape
+  (N, C, out_height, out_width, pool_height, pool_width) holding the pooling
+  windows of x, without copying. Windows may overlap (stride smaller than the
+  window) or skip pixels (stride larger than the window); rows and columns
+  left over at the bottom and right are ignored.
+  """
+  N, C, H, W = x.shape
+  out_height = (H - pool_height) // stride + 1
+  out_width = (W - pool_width) // stride + 1
+  sN, sC, sH, sW = x.strides
+  shape = (N, C, out_height, out_width, pool_height, pool_width)
+  strides = (sN, sC, stride * sH, stride * sW, sH, sW)
+  return np.lib.stride_tricks.as_strided(x, shape=shape, strides=strides,
+                                         writeable=False)
+
+
+def pool_forward_strided(x, pool_param):
+  """
+  Max, average and global pooling over the strided windows of pool_windows.
+
+  Inputs:
+  - x: Input data, of shape (N, C, H, W)
+  - pool_param: dictionary with the keys 'pool_height', 'pool_width' and
+    'stride' as for max_pool_forward_naive, and optionally:
+    - 'mode': 'max' (default) or 'avg'
+    - 'global': If True, pool over the whole image; the window keys are
+      ignored and out has shape (N, C).
+
+  Max pooling caches the flat index into x of each maximum (the first one on
+  ties), so the backward pass is a single bincount.
+
+  Returns a tuple of:
+  - out: Output data
+  - cache: Object to give to pool_backward_strided
+  """
+  N, C, H, W = x.shape
+  mode = pool_param.get('mode', 'max')
+  if pool_param.get('global', False):
+    pool_height, pool_width, stride = H, W, 1
+  else:
+    pool_height, pool_width = pool_param['pool_height'], pool_param['pool_width']
+    stride = pool_param['stride']
+  windows = pool_windows(x, pool_height, pool_width, stride)
+  _, _, out_height, out_width, _, _ = windows.shape
+
+  if mode == 'max':
+    windows = windows.reshape(N, C, out_height, out_width, -1)
+    argmax = windows.argmax(axis=-1)
+    out = np.take_along_axis(windows, argmax[..., np.newaxis], axis=-1)[..., 0]
+
+    # Turn the offsets within the windows into flat indices into x
+    i, j = np.divmod(argmax, pool_width)
+    i += stride * np.arange(out_height).reshape(-1, 1)
+    j += stride * np.arange(out_width)
+    i += H * np.arange(N * C).reshape(N, C, 1, 1)
+    i *= W
+    i += j
+    index_dtype = np.int32 if x.size < 2 ** 31 else np.intp
+    argmax = i.astype(index_dtype)
+    cache = ('max', x.shape, x.dtype, argmax)
+  elif mode == 'avg':
+    out = windows.mean(axis=(4, 5))
+    cache = ('avg', x.shape, x.dtype, (pool_height, pool_width, stride))
+  else:
+    raise ValueError('Unrecognized pooling mode "%s"' % mode)
+
+  if pool_param.get('global', False):
+    out = out.reshape(N, C)
+  return out, cache
+
+
+def pool_backward_strided(dout, cache):
+  """
+  Backward pass for pool_forward_strided.
+
+  Max pooling scatters dout to the cached argmax indices with np.bincount,
+  which sums the gradients of overlapping windows. Average pooling adds the
+  spread-out gradient over strided slices, looping over whichever is smaller
+  of the window offsets and the output positions.
+  """
+  mode, x_shape, dtype, extra = cache
+  N, C, H, W = x_shape
+
+  if mode == 'max':
+    dx = np.bincount(extra.ravel(), weights=dout.ravel(),
+                     minlength=N * C * H * W)
+    return dx.astype(dtype, copy=False).reshape(x_shape)
+
+  pool_height, pool_width, stride = extra
+  out_height = (H - pool_height) // stride + 1
+  out_width = (W - pool_width) // stride + 1
+  dout = dout.reshape(N, C, out_height, out_width) / (pool_height * pool_width)
+  dx = np.zeros(x_shape, dtype=dtype)
+  if pool_height * pool_width <= out_height * out_width:
+    for i in range(pool_height):
+      for j in range(pool_width):
+        dx[:, :, i:i + stride * out_height:stride,
+           j:j + stride * out_width:stride] += dout
+  else:
+    for y in range(out_height):
+      for x in range(out_width):
+        dx[:, :, y * stride:y * stride + pool_height,
+           x * stride:x * stride + pool_width] += dout[:, :, y:y + 1, x:x + 1]
+  return dx
+
+
+def max_pool_forward_nhwc(x, pool_param):
+  """
+  A fast implementation of the forward pass for max pooling on channels-last
+  data of shape (N, H, W, C), for any pooling window and stride.
+
+  The output is the running maximum of one strided view of x per offset in
+  the pooling window, so the channels stay the contiguous innermost axis and
+  no window or column array is built.
+  """
+  N, H, W, C = x.shape
+  pool_height, pool_width = pool_param['pool_height'], pool_param['pool_width']
+  stride = pool_param['stride']
+  out_h = (H - pool_height) // stride + 1
+  out_w = (W - pool_width) // stride + 1
+
+  out = None
+  for i in range(pool_height):
+    for j in range(pool_width):
+      window = x[:, i:i + stride * out_h:stride, j:j + stride * out_w:stride]
+      if out is None:
+        out = window.copy()
+      else:
+        np.maximum(out, window, out=out)
+
+  cache = (x, out, pool_param)
+  return out, cache
+
+
+def max_pool_backward_nhwc(dout, cache):
+  """
+  Backward pass for max_pool_forward_nhwc.
+
+  The gradient of each window goes to the first offset holding its maximum,
+  so ties do not duplicate it, and overlapping windows accumulate.
+  """
+  x, out, pool_param = cache
+  pool_height, pool_width = pool_param['pool_height'], pool_param['pool_width']
+  stride = pool_param['stride']
+  _, out_h, out_w, _ = out.shape
+
+  dx = np.zeros_like(x)
+  assigned = np.zeros(out.shape, dtype=bool)
+  for i in range(pool_height):
+    for j in range(pool_width):
+      view = (slice(None), slice(i, i + stride * out_h, stride),
+              slice(j, j + stride * out_w, stride))
+      hit = x[view] == out
+      hit &= ~assigned
+      assigned |= hit
+      dx[view] += dout * hit
+  return dx
+
+
+def conv_relu_pool_forward_fused(x, w, b, conv_param, pool_param,
+                                 keep_cache=True):
+  """
+  A fused conv - relu - max pool layer, for pooling regions that tile the
+  conv output.
+
+  The batch is processed in chunks of conv_param['tile_size'] images (the
+  whole batch by default). Each chunk's GEMM output is max pooled right away;
+  since the bias and the ReLU commute with the max, they are only applied to
+  the pooled values. Neither the conv nor the ReLU output is kept: the cache
+  holds the input, the pooled output and the window offset of each maximum.
+  With keep_cache=False the offsets are not tracked and the cache is None,
+  for test-time forward passes.
+  """
+  N, C, H, W = x.shape
+  F, _, HH, WW = w.shape
+  stride, pad = int(conv_param['stride']), int(conv_param['pad'])
+  tile_size = int(conv_param.get('tile_size', N))
+  pool_height, pool_width = pool_param['pool_height'], pool_param['pool_width']
+
+  # Check dimensions
+  assert (W + 2 * pad - WW) % stride == 0, 'width does not work'
+  assert (H + 2 * pad - HH) % stride == 0, 'height does not work'
+  out_h = (H + 2 * pad - HH) // stride + 1
+  out_w = (W + 2 * pad - WW) // stride + 1
+  assert pool_height == pool_width == pool_param['stride'], 'Invalid pool params'
+  assert out_h % pool_height == 0 and out_w % pool_width == 0
+  pool_h, pool_w = out_h // pool_height, out_w // pool_width
+
+  out = np.empty((N, F, pool_h, pool_w), dtype=x.dtype)
+  argmax = None
+  if keep_cache:
+    argmax = np.empty((N, F, pool_h, pool_w), dtype=np.uint8)
+
+  w_reshaped = w.reshape(F, -1)
+  for start in range(0, N, tile_size):
+    x_tile = x[start:start + tile_size]
+    n = x_tile.shape[0]
+    x_padded = np.pad(x_tile, ((0, 0), (0, 0), (pad, pad), (pad, pad)),
+                      mode='constant')
+    x_cols = strided_cols(x_padded, HH, WW, stride, out_h, out_w)
+    res = w_reshaped.dot(x_cols).reshape(F, n, pool_h, pool_height,
+                                         pool_w, pool_width)
+
+    # Running max over the offsets within the pooling windows
+    pooled = res[:, :, :, 0, :, 0].copy()
+    if keep_cache:
+      idx = np.zeros(pooled.shape, dtype=np.uint8)
+    for k in range(1, pool_height * pool_width):
+      i, j = divmod(k, pool_width)
+      view = res[:, :, :, i, :, j]
+      if keep_cache:
+        idx[view > pooled] = k
+      np.maximum(pooled, view, out=pooled)
+
+    pooled += b.reshape(-1, 1, 1, 1)
+    np.maximum(pooled, 0, out=pooled)
+    out[start:start + n] = pooled.transpose(1, 0, 2, 3)
+    if keep_cache:
+      argmax[start:start + n] = idx.transpose(1, 0, 2, 3)
+
+  if not keep_cache:
+    return out, None
+  cache = (x, w, b, conv_param, pool_param, out, argmax)
+  return out, cache
+
+
+def conv_relu_pool_backward_fused(dout, cache):
+  """
+  Backward pass for conv_relu_pool_forward_fused.
+
+  The gradient of each window goes to its cached argmax if the ReLU was
+  active; the conv gradients are then computed with conv_backward_tiled.
+  """
+  x, w, b, conv_param, pool_param, out, argmax = cache
+  N, F, pool_h, pool_w = out.shape
+  pool_height, pool_width = pool_param['pool_height'], pool_param['pool_width']
+
+  dpooled = dout * (out > 0)
+  db = np.sum(dpooled, axis=(0, 2, 3))
+
+  da = np.zeros((N, F, pool_h, pool_height, pool_w, pool_width),
+                dtype=dout.dtype)
+  for k in range(pool_height * pool_width):
+    i, j = divmod(k, pool_width)
+    da[:, :, :, i, :, j] = np.where(argmax == k, dpooled, 0)
+  da.shape = (N, F, pool_h * pool_height, pool_w * pool_width)
+
+  dx, dw, _ = conv_backward_tiled(da, (x, w, b, conv_param))
+  return dx, dw, db
@@ -0,0 +1,72 @@
+import numpy as np
+
+"""
+Helpers to keep all the parameters of a model in one contiguous buffer.
+
+The per-parameter arrays of model.params are replaced by views into a single
+1-D buffer, so that an optimizer can update every parameter at once with the
+*_foreach update rules in optim.py, instead of looping over the parameters
+and allocating new arrays for each of them.
+"""
+
+
+def flat_views(buffer, shapes):
+  """
+  Split a 1-D buffer into views with the given shapes.
+
+  Inputs:
+  - buffer: 1-D array with at least as many elements as the shapes need
+  - shapes: List of (name, shape) tuples
+
+  Returns:
+  - views: Dictionary mapping each name to a view of buffer with its shape;
+    the views follow each other in the order of shapes.
+  """
+  views = {}
+  offset = 0
+  for name, shape in shapes:
+    size = int(np.prod(shape))
+    views[name] = buffer[offset:offset + size].reshape(shape)
+    offset += size
+  return views
+
+
+def param_shapes(params):
+  """
+  Returns the (name, shape) list of a parameter dictionary, in the order the
+  parameters are laid out in a flat buffer.
+  """
+  return [(name, params[name].shape) for name in sorted(params)]
+
+
+def flatten_params(params, dtype=None):
+  """
+  Copy a dictionary of parameter arrays into one contiguous buffer.
+
+  Inputs:
+  - params: Dictionary mapping parameter names to arrays
+  - dtype: dtype of the buffer; defaults to the common type of the params
+
+  Returns a tuple of:
+  - buffer: 1-D array holding all the parameters
+  - views: Dictionary with the same keys as params mapping to views of
+    buffer with the original shapes. Assigning into these views with [...]
+    updates the buffer; rebinding the dictionary entries does not.
+  """
+  if dtype is None:
+    dtype = np.result_type(*params.values())
+  shapes = param_shapes(params)
+  buffer = np.empty(sum(int(np.prod(s)) for _, s in shapes), dtype=dtype)
+  views = flat_views(buffer, shapes)
+  for name, view in views.items():
+    view[...] = params[name]
+  return buffer, views
+
+
+def flatten_grads(grads, views):
+  """
+  Copy a dictionary of gradients into the flat buffer behind views, as
+  returned by flat_views for the gradient buffer.
+  """
+  for name, view in views.items():
+    view[...] = grads[name]
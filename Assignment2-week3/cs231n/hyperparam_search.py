@@ -0,0 +1,325 @@
+import itertools
+import json
+import multiprocessing
+import sqlite3
+import time
+
+import numpy as np
+
+from cs231n.solver import Solver
+
+"""
+Hyperparameter search over Solver trials.
+
+A search space is a dictionary mapping hyperparameter names to a list of
+values, a sampling function f(rng) such as uniform(), log_uniform() or
+choice(), or a constant. grid_configs and random_configs turn it into a list
+of configs, which are dictionaries of hyperparameter values.
+
+A trial is a function train_fn(config, budget) that trains a model with the
+given hyperparameters for budget units (epochs, iterations, ...) and returns a
+dictionary with at least a 'val_acc_history' list; solver_trial builds one
+that trains a model with a Solver. run_trials runs a list of configs at one
+budget, in worker processes if asked to, and successive_halving runs rounds of
+them at growing budgets, keeping only the best 1 / eta of the configs after
+each round. Every finished trial is recorded in a ResultsTable, an SQLite
+table that can be queried with SQL.
+
+The worker processes are forked and inherit train_fn and the data it refers
+to, so nothing but the configs and the results is pickled and train_fn may
+be a closure; this needs a POSIX system.
+"""
+
+
+def uniform(low, high):
+  """ Sample uniformly from [low, high). """
+  return lambda rng: float(rng.uniform(low, high))
+
+
+def log_uniform(low, high):
+  """
+  Sample uniformly on a log scale from [low, high), as is usual for learning
+  rates and regularization strengths.
+  """
+  return lambda rng: float(np.exp(rng.uniform(np.log(low), np.log(high))))
+
+
+def choice(values):
+  """ Sample one of values uniformly. """
+  values = list(values)
+  return lambda rng: values[rng.randint(len(values))]
+
+
+def random_configs(space, num_configs, seed=None):
+  """
+  Draw random configs from a search space.
+
+  Inputs:
+  - space: Dictionary mapping names to sampling functions, lists of values
+    (sampled uniformly) or constants
+  - num_configs: Number of configs to draw
+  - seed: Optional seed for the random number generator
+
+  Returns:
+  - configs: List of num_configs dictionaries mapping names to values
+  """
+  rng = np.random.RandomState(seed)
+  configs = []
+  for _ in range(num_configs):
+    config = {}
+    for name in sorted(space):
+      value = space[name]
+      if isinstance(value, list):
+        value = choice(value)
+      config[name] = value(rng) if callable(value) else value
+    configs.append(config)
+  return configs
+
+
+def grid_configs(space):
+  """
+  Returns the list of all the combinations of the values in a search space
+  whose entries are lists of values or constants.
+  """
+  names = sorted(space)
+  values = []
+  for name in names:
+    value = space[name]
+    if callable(value):
+      raise ValueError('Cannot grid search over sampled "%s"' % name)
+    values.append(value if isinstance(value, list) else [value])
+  return [dict(zip(names, combination))
+          for combination in itertools.product(*values)]
+
+
+def trial_score(result):
+  """ The score configs are ranked by: the best validation accuracy. """
+  history = result.get('val_acc_history')
+  return float(max(history)) if history else float('-inf')
+
+
+def _quote(name):
+  """ Quote name as an SQL identifier. """
+  return '"%s"' % name.replace('"', '""')
+
+
+class ResultsTable(object):
+  """
+  An SQLite table with one row per finished trial.
+
+  The table "trials" has the columns trial, rung, budget, score (see
+  trial_score), train_acc, seconds, config and result (JSON), plus a column
+  hp_<name> per hyperparameter, so that results can be queried with SQL:
+
+  table.query('SELECT hp_learning_rate, MAX(score) FROM trials GROUP BY 1')
+
+  Hyperparameter names must be Python identifiers.
+  """
+
+  def __init__(self, path=':memory:'):
+    """
+    Open (and create if needed) the table in the SQLite database at path;
+    the default keeps it in memory.
+    """
+    self.db = sqlite3.connect(path)
+    self.db.execute('CREATE TABLE IF NOT EXISTS trials (trial INTEGER, '
+                    'rung INTEGER, budget REAL, score REAL, train_acc REAL, '
+                    'seconds REAL, config TEXT, result TEXT)')
+    self.db.commit()
+
+  def _column_names(self):
+    return [row[1] for row in self.db.execute('PRAGMA table_info(trials)')]
+
+  def add(self, record):
+    """
+    Insert a record as returned by run_trials, adding a column for every
+    hyperparameter not seen before.
+    """
+    config = record['config']
+    for name in config:
+      if not isinstance(name, str) or not name.isidentifier():
+        raise ValueError('Invalid hyperparameter name %r' % (name,))
+    existing = self._column_names()
+    for name in config:
+      if 'hp_' + name not in existing:
+        self.db.execute('ALTER TABLE trials ADD COLUMN %s'
+                        % _quote('hp_' + name))
+    values = {
+      'trial': record['trial'],
+      'rung': record['rung'],
+      'budget': record['budget'],
+      'score': record['score'],
+      'train_acc': record['result'].get('train_acc'),
+      'seconds': record['seconds'],
+      'config': json.dumps(config, default=str),
+      'result': json.dumps(record['result'], default=float),
+    }
+    for name, value in config.items():
+      if not isinstance(value, (int, float, str)):
+        value = str(value)
+      values['hp_' + name] = value
+    names = list(values)
+    self.db.execute('INSERT INTO trials (%s) VALUES (%s)' % (
+        ', '.join(_quote(n) for n in names), ', '.join('?' * len(names))),
+        [values[n] for n in names])
+    self.db.commit()
+
+  def query(self, sql, args=()):
+    """ Run an SQL query and return the list of rows. """
+    return self.db.execute(sql, args).fetchall()
+
+  def best(self, n=1, rung=None):
+    """
+    Returns the configs and scores of the n best trials (of one rung, if
+    given) as a list of (score, config) tuples.
+    """
+    sql = 'SELECT score, config FROM trials'
+    args = ()
+    if rung is not None:
+      sql += ' WHERE rung = ?'
+      args = (rung,)
+    rows = self.query(sql + ' ORDER BY score DESC LIMIT ?', args + (n,))
+    return [(score, json.loads(config)) for score, config in rows]
+
+
+# Set in each worker by _init_worker
+_worker = {}
+
+
+def _init_worker(train_fn):
+  _worker['train_fn'] = train_fn
+
+
+def _run_trial(args):
+  """ Run one trial, seeding np.random with the trial's seed first. """
+  trial, config, budget, seed = args
+  train_fn = _worker['train_fn']
+  np.random.seed(seed)
+  start = time.time()
+  result = train_fn(config, budget)
+  return trial, result, time.time() - start
+
+
+def run_trials(train_fn, configs, budget, num_workers=0, table=None, rung=0,
+               trials=None, seed=0, verbose=False):
+  """
+  Run train_fn on each config at one budget.
+
+  Inputs:
+  - train_fn: Function train_fn(config, budget) returning a result dictionary
+    with at least a 'val_acc_history' list
+  - configs: List of configs
+  - budget: Budget to pass to train_fn
+  - num_workers: Number of worker processes; 0 runs the trials in this one
+  - table: Optional ResultsTable to record the trials in
+  - rung: Round number to record, for successive_halving
+  - trials: Optional list of trial ids, one per config; defaults to
+    0, ..., len(configs) - 1
+  - seed: np.random is seeded with [seed, trial] before each trial, so the
+    results do not depend on the number of workers
+  - verbose: Boolean; if True print the score of each trial
+
+  Returns:
+  - records: List of dictionaries with the keys trial, rung, budget, config,
+    score, seconds and result, in the order of configs
+  """
+  if trials is None:
+    trials = list(range(len(configs)))
+  tasks = [(trial, config, budget, [seed, trial])
+           for trial, config in zip(trials, configs)]
+  if num_workers > 0:
+    context = multiprocessing.get_context('fork')
+    pool = context.Pool(num_workers, initializer=_init_worker,
+                        initargs=(train_fn,))
+    try:
+      outputs = pool.map(_run_trial, tasks, chunksize=1)
+    finally:
+      pool.close()
+      pool.join()
+  else:
+    _init_worker(train_fn)
+    outputs = [_run_trial(task) for task in tasks]
+
+  records = []
+  for (trial, config, _, _), (_, result, seconds) in zip(tasks, outputs):
+    record = {'trial': trial, 'rung': rung, 'budget': budget,
+              'config': config, 'score': trial_score(result),
+              'seconds': seconds, 'result': result}
+    records.append(record)
+    if table is not None:
+      table.add(record)
+    if verbose:
+      print('(Trial %d, budget %s) score %f: %s' % (
+             trial, budget, record['score'], config))
+  return records
+
+
+def successive_halving(train_fn, configs, min_budget, max_budget, eta=3,
+                       num_workers=0, table=None, seed=0, verbose=False):
+  """
+  Successive halving: run every config at min_budget, keep the best
+  1 / eta of them (at least one), run those at eta times the budget, and so
+  on until max_budget. Each round trains from scratch.
+
+  Inputs:
+  - train_fn, configs, num_workers, table, seed, verbose: As for run_trials
+  - min_budget: Budget of the first round
+  - max_budget: Largest budget; the last round uses exactly this
+  - eta: Factor by which the budget grows and the configs shrink per round
+
+  Returns:
+  - records: The records of the last round, best first
+  """
+  if table is None:
+    table = ResultsTable()
+  trials = list(range(len(configs)))
+  budget = min_budget
+  rung = 0
+  while True:
+    records = run_trials(train_fn, configs, budget, num_workers=num_workers,
+                         table=table, rung=rung, trials=trials, seed=seed,
+                         verbose=verbose)
+    records.sort(key=lambda r: r['score'], reverse=True)
+    if budget >= max_budget or len(records) == 1:
+      return records
+    keep = records[:max(len(records) // eta, 1)]
+    configs = [r['config'] for r in keep]
+    trials = [r['trial'] for r in keep]
+    budget = min(budget * eta, max_budget)
+    rung += 1
+
+
+def solver_trial(build_model, data, **solver_kwargs):
+  """
+  Returns a train_fn that trains a model with a Solver for budget epochs.
+
+  Inputs:
+  - build_model: Function build_model(config) returning a new model
+  - data: Data dictionary as for Solver
+  - solver_kwargs: Other keyword arguments for Solver
+
+  The config entries 'learning_rate' (which goes into optim_config),
+  'update_rule', 'lr_decay' and 'batch_size' are passed to the Solver; the
+  whole config is passed to build_model. The result holds the accuracy
+  histories and the final loss.
+  """
+  def train_fn(config, budget):
+    kwargs = dict(solver_kwargs)
+    kwargs.setdefault('verbose', False)
+    optim_config = dict(kwargs.pop('optim_config', {}))
+    if 'learning_rate' in config:
+      optim_config['learning_rate'] = config['learning_rate']
+    for k in ('update_rule', 'lr_decay', 'batch_size'):
+      if k in config:
+        kwargs[k] = config[k]
+    solver = Solver(build_model(config), data, num_epochs=budget,
+                    optim_config=optim_config, **kwargs)
+    solver.train()
+    train_acc = (solver.train_acc_history[-1]
+                 if solver.train_acc_history else None)
+    return {'val_acc_history': [float(a) for a in solver.val_acc_history],
+            'train_acc_history': [float(a) for a in solver.train_acc_history],
+            'train_acc': None if train_acc is None else float(train_acc),
+            'loss': float(solver.loss_history[-1])}
+
+  return train_fn
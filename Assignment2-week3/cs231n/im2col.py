@@ -5,9 +5,9 @@ def get_im2col_indices(x_shape, field_height, field_width, padding=1, stride=1):
   # First figure out what the size of the output should be
   N, C, H, W = x_shape
   assert (H + 2 * padding - field_height) % stride == 0
-  assert (W + 2 * padding - field_height) % stride == 0
-  out_height = (H + 2 * padding - field_height) / stride + 1
-  out_width = (W + 2 * padding - field_width) / stride + 1
+  assert (W + 2 * padding - field_width) % stride == 0
+  out_height = (H + 2 * padding - field_height) // stride + 1
+  out_width = (W + 2 * padding - field_width) // stride + 1
 
   i0 = np.repeat(np.arange(field_height), field_width)
   i0 = np.tile(i0, C)
@@ -53,3 +53,25 @@ def col2im_indices(cols, x_shape, field_height=3, field_width=3, padding=1,
   return x_padded[:, :, padding:-padding, padding:-padding]
 
 pass
+
+
+def col2im_6d(cols, N, C, H, W, field_height, field_width, padding=1, stride=1):
+  """
+  A NumPy version of col2im_6d_cython, for cols of shape
+  (C, field_height, field_width, N, out_height, out_width).
+
+  Instead of np.add.at this loops over the field_height * field_width kernel
+  offsets; the pixels one offset touches never overlap, so each offset is a
+  single vectorized add into a strided slice of the padded input.
+  """
+  out_height = (H + 2 * padding - field_height) // stride + 1
+  out_width = (W + 2 * padding - field_width) // stride + 1
+  H_padded, W_padded = H + 2 * padding, W + 2 * padding
+  x_padded = np.zeros((N, C, H_padded, W_padded), dtype=cols.dtype)
+  for i in range(field_height):
+    for j in range(field_width):
+      x_padded[:, :, i:i + stride * out_height:stride,
+               j:j + stride * out_width:stride] += cols[:, i, j].transpose(1, 0, 2, 3)
+  if padding == 0:
+    return x_padded
+  return x_padded[:, :, padding:-padding, padding:-padding]
@@ -1,6 +1,7 @@
 import numpy as np
 cimport numpy as np
 cimport cython
+from cython.parallel cimport prange
 
 # DTYPE = np.float64
 
@@ -8,113 +9,133 @@ ctypedef fused DTYPE_t:
     np.float32_t
     np.float64_t
 
+# The kernels below release the GIL and split their outer loop over OpenMP
+# threads (see setup.py for the compiler flags; without OpenMP they simply
+# run on one thread). Each thread owns a disjoint set of output rows, so the
+# scatter-adds in col2im need no atomics.
+#
+# The columns are ordered (row, out_y, out_x, n) with the batch index
+# innermost, matching im2col.py. im2col and col2im therefore work on a
+# channels-last (C, H, W, N) copy of the padded input, so that the innermost
+# loop over the batch reads and writes unit-stride memory on both sides.
+
 def im2col_cython(np.ndarray[DTYPE_t, ndim=4] x, int field_height,
                   int field_width, int padding, int stride):
     cdef int N = x.shape[0]
     cdef int C = x.shape[1]
     cdef int H = x.shape[2]
     cdef int W = x.shape[3]
-    
+
     cdef int HH = (H + 2 * padding - field_height) // stride + 1
     cdef int WW = (W + 2 * padding - field_width) // stride + 1
 
     cdef int p = padding
-    cdef np.ndarray[DTYPE_t, ndim=4] x_padded = np.pad(x,
-            ((0, 0), (0, 0), (p, p), (p, p)), mode='constant')
+    cdef DTYPE_t[:, :, :, ::1] x_padded = np.ascontiguousarray(np.pad(
+            x, ((0, 0), (0, 0), (p, p), (p, p)), mode='constant'
+            ).transpose(1, 2, 3, 0))
 
-    cdef np.ndarray[DTYPE_t, ndim=2] cols = np.zeros(
-            (C * field_height * field_width, N * HH * WW),
-            dtype=x.dtype)
+    cols = np.empty((C * field_height * field_width, N * HH * WW),
+                    dtype=x.dtype)
+    cdef DTYPE_t[:, ::1] cols_view = cols
 
-    # Moving the inner loop to a C function with no bounds checking works, but does
-    # not seem to help performance in any measurable way.
-
-    im2col_cython_inner(cols, x_padded, N, C, H, W, HH, WW,
-                        field_height, field_width, padding, stride)
+    im2col_cython_inner(cols_view, x_padded, N, C, HH, WW,
+                        field_height, field_width, stride)
     return cols
 
 
 @cython.boundscheck(False)
-cdef int im2col_cython_inner(np.ndarray[DTYPE_t, ndim=2] cols,
-                             np.ndarray[DTYPE_t, ndim=4] x_padded,
-                             int N, int C, int H, int W, int HH, int WW,
-                             int field_height, int field_width, int padding, int stride) except? -1:
-    cdef int c, ii, jj, row, yy, xx, i, col
-
-    for c in range(C):
+@cython.wraparound(False)
+cdef void im2col_cython_inner(DTYPE_t[:, ::1] cols,
+                              DTYPE_t[:, :, :, ::1] x_padded,
+                              int N, int C, int HH, int WW,
+                              int field_height, int field_width,
+                              int stride) noexcept nogil:
+    cdef Py_ssize_t row, c, ii, jj, yy, xx, i, col
+    cdef Py_ssize_t num_rows = C * field_height * field_width
+
+    for row in prange(num_rows, schedule='static'):
+        c = row // (field_height * field_width)
+        ii = row // field_width % field_height
+        jj = row % field_width
+        col = 0
         for yy in range(HH):
             for xx in range(WW):
-                for ii in range(field_height):
-                    for jj in range(field_width):
-                        row = c * field_width * field_height + ii * field_height + jj
-                        for i in range(N):
-                            col = yy * WW * N + xx * N + i
-                            cols[row, col] = x_padded[i, c, stride * yy + ii, stride * xx + jj]
-
+                for i in range(N):
+                    cols[row, col + i] = x_padded[c, stride * yy + ii,
+                                                  stride * xx + jj, i]
+                col = col + N
 
 
 def col2im_cython(np.ndarray[DTYPE_t, ndim=2] cols, int N, int C, int H, int W,
                   int field_height, int field_width, int padding, int stride):
-    cdef np.ndarray x = np.empty((N, C, H, W), dtype=cols.dtype)
     cdef int HH = (H + 2 * padding - field_height) // stride + 1
     cdef int WW = (W + 2 * padding - field_width) // stride + 1
-    cdef np.ndarray[DTYPE_t, ndim=4] x_padded = np.zeros((N, C, H + 2 * padding, W + 2 * padding),
-                                        dtype=cols.dtype)
-
-    # Moving the inner loop to a C-function with no bounds checking improves
-    # performance quite a bit for col2im.
-    col2im_cython_inner(cols, x_padded, N, C, H, W, HH, WW, 
-                        field_height, field_width, padding, stride)
+    x_padded = np.zeros((C, H + 2 * padding, W + 2 * padding, N),
+                        dtype=cols.dtype)
+    cdef DTYPE_t[:, :, :, ::1] x_padded_view = x_padded
+    cdef DTYPE_t[:, ::1] cols_view = np.ascontiguousarray(cols)
+
+    col2im_cython_inner(cols_view, x_padded_view, N, C, HH, WW,
+                        field_height, field_width, stride)
+    x = x_padded.transpose(3, 0, 1, 2)
     if padding > 0:
-        return x_padded[:, :, padding:-padding, padding:-padding]
-    return x_padded
+        return x[:, :, padding:-padding, padding:-padding]
+    return x
 
 
 @cython.boundscheck(False)
-cdef int col2im_cython_inner(np.ndarray[DTYPE_t, ndim=2] cols,
-                             np.ndarray[DTYPE_t, ndim=4] x_padded,
-                             int N, int C, int H, int W, int HH, int WW,
-                             int field_height, int field_width, int padding, int stride) except? -1:
-    cdef int c, ii, jj, row, yy, xx, i, col
-
-    for c in range(C):
+@cython.wraparound(False)
+cdef void col2im_cython_inner(DTYPE_t[:, ::1] cols,
+                              DTYPE_t[:, :, :, ::1] x_padded,
+                              int N, int C, int HH, int WW,
+                              int field_height, int field_width,
+                              int stride) noexcept nogil:
+    cdef Py_ssize_t c, ii, jj, row, yy, xx, i, col
+
+    # Rows of different channels never touch the same input pixel, so the
+    # channels are split over the threads.
+    for c in prange(C, schedule='static'):
         for ii in range(field_height):
             for jj in range(field_width):
-                row = c * field_width * field_height + ii * field_height + jj
+                row = (c * field_height + ii) * field_width + jj
+                col = 0
                 for yy in range(HH):
                     for xx in range(WW):
                         for i in range(N):
-                            col = yy * WW * N + xx * N + i
-                            x_padded[i, c, stride * yy + ii, stride * xx + jj] += cols[row, col]
+                            x_padded[c, stride * yy + ii, stride * xx + jj, i] += cols[row, col + i]
+                        col = col + N
 
 
 @cython.boundscheck(False)
 @cython.wraparound(False)
-cdef col2im_6d_cython_inner(np.ndarray[DTYPE_t, ndim=6] cols,
-                            np.ndarray[DTYPE_t, ndim=4] x_padded,
-                            int N, int C, int H, int W, int HH, int WW,
-                            int out_h, int out_w, int pad, int stride):
-
-    cdef int c, hh, ww, n, h, w
-    for n in range(N):
-        for c in range(C):
-            for hh in range(HH):
-                for ww in range(WW):
-                    for h in range(out_h):
-                        for w in range(out_w):
-                            x_padded[n, c, stride * h + hh, stride * w + ww] += cols[c, hh, ww, n, h, w]
-    
+cdef void col2im_6d_cython_inner(DTYPE_t[:, :, :, :, :, :] cols,
+                                 DTYPE_t[:, :, :, ::1] x_padded,
+                                 int N, int C, int HH, int WW,
+                                 int out_h, int out_w, int stride) noexcept nogil:
+    cdef Py_ssize_t nc, n, c, hh, ww, h, w
+
+    # Every (n, c) image plane is independent.
+    for nc in prange(N * C, schedule='static'):
+        n = nc // C
+        c = nc % C
+        for hh in range(HH):
+            for ww in range(WW):
+                for h in range(out_h):
+                    for w in range(out_w):
+                        x_padded[n, c, stride * h + hh, stride * w + ww] += cols[c, hh, ww, n, h, w]
+
 
 def col2im_6d_cython(np.ndarray[DTYPE_t, ndim=6] cols, int N, int C, int H, int W,
         int HH, int WW, int pad, int stride):
-    cdef np.ndarray x = np.empty((N, C, H, W), dtype=cols.dtype)
     cdef int out_h = (H + 2 * pad - HH) // stride + 1
     cdef int out_w = (W + 2 * pad - WW) // stride + 1
-    cdef np.ndarray[DTYPE_t, ndim=4] x_padded = np.zeros((N, C, H + 2 * pad, W + 2 * pad),
-                                                  dtype=cols.dtype)
+    x_padded = np.zeros((N, C, H + 2 * pad, W + 2 * pad), dtype=cols.dtype)
+    cdef DTYPE_t[:, :, :, ::1] x_padded_view = x_padded
+    cdef DTYPE_t[:, :, :, :, :, :] cols_view = cols
 
-    col2im_6d_cython_inner(cols, x_padded, N, C, H, W, HH, WW, out_h, out_w, pad, stride)
+    col2im_6d_cython_inner(cols_view, x_padded_view, N, C, HH, WW, out_h, out_w,
+                           stride)
 
     if pad > 0:
         return x_padded[:, :, pad:-pad, pad:-pad]
-    return x_padded 
+    return x_padded
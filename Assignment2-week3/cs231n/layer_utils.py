@@ -33,16 +33,21 @@ def affine_relu_backward(dout, cache):
 pass
 
 def affine_bn_relu_forward(x , w , b, gamma, beta, bn_param):
+    """
+    Convenience layer that performs an affine transform, a batch
+    normalization and a ReLU. The ReLU is applied in place to the
+    batchnorm output, whose positive entries give the ReLU mask.
+    """
     a, fc_cache = affine_forward(x, w, b)
-    bn, bn_cache = batchnorm_forward(a, gamma, beta, bn_param)
-    out, relu_cache = relu_forward(bn)
-    cache = (fc_cache, bn_cache, relu_cache)
+    out, bn_cache = batchnorm_forward_fast(a, gamma, beta, bn_param)
+    np.maximum(out, 0, out=out)
+    cache = (fc_cache, bn_cache, out)
     return out, cache
 
 def affine_bn_relu_backward(dout, cache):
-    fc_cache, bn_cache, relu_cache = cache
-    dbn = relu_backward(dout, relu_cache)
-    da, dgamma, dbeta =  batchnorm_backward_alt(dbn, bn_cache)
+    fc_cache, bn_cache, out = cache
+    dbn = dout * (out > 0)
+    da, dgamma, dbeta =  batchnorm_backward_fast(dbn, bn_cache)
     dx, dw, db = affine_backward(da, fc_cache)
     return dx, dw, db, dgamma, dbeta
 
@@ -84,10 +89,23 @@ def conv_relu_pool_forward(x, w, b, conv_param, pool_param):
   - w, b, conv_param: Weights and parameters for the convolutional layer
   - pool_param: Parameters for the pooling layer
 
+  If conv_param has a 'layout' key, the pooling layer uses the same layout.
+
+  When the pooling regions tile the conv output and conv_forward_fast would
+  use a strided im2col method anyway, the three layers run fused in
+  conv_relu_pool_forward_fused, which keeps neither the conv nor the ReLU
+  output alive.
+
   Returns a tuple of:
   - out: Output from the pooling layer
   - cache: Object to give to the backward pass
   """
+  if 'layout' in conv_param:
+    pool_param = dict(pool_param, layout=conv_param['layout'])
+  if _can_fuse_conv_relu_pool(x, w, conv_param, pool_param):
+    out, fused_cache = conv_relu_pool_forward_fused(x, w, b, conv_param,
+                                                    pool_param)
+    return out, ('fused', fused_cache)
   a, conv_cache = conv_forward_fast(x, w, b, conv_param)
   s, relu_cache = relu_forward(a)
   out, pool_cache = max_pool_forward_fast(s, pool_param)
@@ -99,9 +117,90 @@ def conv_relu_pool_backward(dout, cache):
   """
   Backward pass for the conv-relu-pool convenience layer
   """
+  if cache[0] == 'fused':
+    return conv_relu_pool_backward_fused(dout, cache[1])
   conv_cache, relu_cache, pool_cache = cache
   ds = max_pool_backward_fast(dout, pool_cache)
   da = relu_backward(ds, relu_cache)
   dx, dw, db = conv_backward_fast(da, conv_cache)
   return dx, dw, db
 
+
+# Default bound on the size of the im2col columns of conv_relu_pool_predict
+predict_cols_bytes = 1 << 24
+
+
+def conv_relu_pool_predict(x, w, b, conv_param, pool_param):
+  """
+  Test-time forward pass of the conv-relu-pool convenience layer, which
+  returns just the output. On the fused path no cache is built at all;
+  otherwise the caches of the three layers are dropped as soon as possible.
+  Unless conv_param has a 'method', the conv method is picked by the cost of
+  its forward pass alone; im2col based methods then run in tiles whose
+  columns take at most predict_cols_bytes (or conv_param['tile_size']
+  images).
+  """
+  if 'layout' in conv_param:
+    pool_param = dict(pool_param, layout=conv_param['layout'])
+  if 'method' not in conv_param and conv_param.get('layout', 'NCHW') == 'NCHW':
+    costs = conv_cost(x.shape, w.shape, conv_param, backward=False)
+    method = min(costs, key=costs.get)
+    if method in ('strides', 'im2col'):
+      method = 'tiled'
+    conv_param = dict(conv_param, method=method)
+  if conv_param.get('method') == 'tiled' and 'tile_size' not in conv_param:
+    _, C, H, W = x.shape
+    _, _, HH, WW = w.shape
+    stride, pad = conv_param['stride'], conv_param['pad']
+    out_h = (H + 2 * pad - HH) // stride + 1
+    out_w = (W + 2 * pad - WW) // stride + 1
+    image_bytes = C * HH * WW * out_h * out_w * x.dtype.itemsize
+    conv_param = dict(conv_param,
+                      tile_size=max(predict_cols_bytes // image_bytes, 1))
+  if _can_fuse_conv_relu_pool(x, w, conv_param, pool_param):
+    out, _ = conv_relu_pool_forward_fused(x, w, b, conv_param, pool_param,
+                                          keep_cache=False)
+    return out
+  a, _ = conv_forward_fast(x, w, b, conv_param)
+  np.maximum(a, 0, out=a)
+  out, _ = max_pool_forward_fast(a, pool_param)
+  return out
+
+
+def predict_buffer(buffers, key, shape, dtype):
+  """
+  Returns a C-contiguous array of the given shape and dtype backed by
+  buffers[key], a 1-D array that is only reallocated when it is too small
+  (or of another dtype). Test-time forward passes use this to reuse their
+  activation arrays across calls.
+  """
+  size = int(np.prod(shape))
+  buf = buffers.get(key)
+  if buf is None or buf.size < size or buf.dtype != dtype:
+    buf = buffers[key] = np.empty(size, dtype=dtype)
+  return buf[:size].reshape(shape)
+
+
+def _can_fuse_conv_relu_pool(x, w, conv_param, pool_param):
+  """
+  Whether conv_relu_pool_forward can use conv_relu_pool_forward_fused.
+  """
+  if conv_param.get('layout', 'NCHW') != 'NCHW':
+    return False
+  method = conv_param.get('method')
+  if method is None:
+    costs = conv_cost(x.shape, w.shape, conv_param)
+    method = min(costs, key=costs.get)
+  if method not in ('strides', 'tiled', 'im2col'):
+    return False
+
+  _, _, H, W = x.shape
+  _, _, HH, WW = w.shape
+  stride, pad = conv_param['stride'], conv_param['pad']
+  pool_height, pool_width = pool_param['pool_height'], pool_param['pool_width']
+  out_h = (H + 2 * pad - HH) // stride + 1
+  out_w = (W + 2 * pad - WW) // stride + 1
+  same_size = pool_height == pool_width == pool_param['stride']
+  tiles = out_h % pool_height == 0 and out_w % pool_width == 0
+  return same_size and tiles and pool_height * pool_width <= 256
+
@@ -68,6 +68,27 @@ def affine_backward(dout, cache):
   return dx, dw, db
 
 
+def affine_forward_into(x, w, b, out, relu=False):
+  """
+  Test-time forward pass for an affine layer, optionally followed by a ReLU,
+  that writes into a preallocated array and keeps no cache.
+
+  Inputs:
+  - x: Input data, of shape (N, d_1, ..., d_k)
+  - w, b: Weights and biases as for affine_forward
+  - out: C-contiguous array of shape (N, M) and of the dtype of x.dot(w)
+  - relu: If True, apply a ReLU in place
+
+  Returns:
+  - out: The same array, holding the output
+  """
+  np.dot(x.reshape(x.shape[0], -1), w, out=out)
+  out += b
+  if relu:
+    np.maximum(out, 0, out=out)
+  return out
+
+
 def relu_forward(x):
   """
   Computes the forward pass for a layer of rectified linear units (ReLUs).
@@ -297,6 +318,133 @@ def batchnorm_backward_alt(dout, cache):
   return dx, dgamma, dbeta
 
 
+def batchnorm_forward_fast(x, gamma, beta, bn_param, axis=0):
+  """
+  A faster forward pass for batch normalization over any set of axes.
+
+  The batch is centered into a single new buffer, whose second moment gives
+  the variance and which is then scaled in place into x_hat; together with
+  the output this is the only full-size allocation. The cache holds just
+  x_hat and gamma times the per-feature inverse standard deviation.
+
+  Inputs:
+  - x: Data of any shape
+  - gamma, beta: Scale and shift parameters, one per feature, where the
+    features are the axes of x not in axis
+  - bn_param: Dictionary as for batchnorm_forward
+  - axis: Axis or tuple of axes of x to normalize over; 0 for (N, D) data,
+    (0, 2, 3) for (N, C, H, W) data
+
+  Returns a tuple of:
+  - out: Output data, of the same shape as x
+  - cache: A tuple of values needed by batchnorm_backward_fast
+  """
+  mode = bn_param['mode']
+  eps = bn_param.get('eps', 1e-5)
+  momentum = bn_param.get('momentum', 0.9)
+
+  axes = (axis,) if np.isscalar(axis) else tuple(axis)
+  param_shape = tuple(1 if i in axes else d for i, d in enumerate(x.shape))
+  D = int(np.prod([x.shape[i] for i in range(x.ndim) if i not in axes]))
+  running_mean = bn_param.get('running_mean', np.zeros(D, dtype=x.dtype))
+  running_var = bn_param.get('running_var', np.zeros(D, dtype=x.dtype))
+  gamma = gamma.reshape(param_shape)
+  beta = beta.reshape(param_shape)
+
+  cache = None
+  if mode == 'train':
+    sample_mean = x.mean(axis=axes, keepdims=True)
+    x_hat = x - sample_mean
+    sample_var = _sum_of_products(x_hat, x_hat, axes) / (x.size // D)
+    inv_std = 1.0 / np.sqrt(sample_var.reshape(param_shape) + eps)
+    x_hat *= inv_std
+    out = x_hat * gamma
+    out += beta
+    cache = (x_hat, gamma * inv_std)
+    running_mean = momentum * running_mean + (1 - momentum) * sample_mean.ravel()
+    running_var = momentum * running_var + (1 - momentum) * sample_var
+  elif mode == 'test':
+    scale = gamma / np.sqrt(running_var.reshape(param_shape) + eps)
+    out = x * scale
+    out += beta - running_mean.reshape(param_shape) * scale
+  else:
+    raise ValueError('Invalid forward batchnorm mode "%s"' % mode)
+
+  # Store the updated running means back into bn_param
+  bn_param['running_mean'] = running_mean
+  bn_param['running_var'] = running_var
+
+  return out, cache
+
+
+def batchnorm_backward_fast(dout, cache):
+  """
+  Backward pass for batchnorm_forward_fast, using the closed form
+
+  dx = gamma * inv_std * (dout - mean(dout) - x_hat * mean(dout * x_hat))
+
+  accumulated in place in a single output buffer.
+
+  Inputs:
+  - dout: Upstream derivatives, of the same shape as x
+  - cache: Variable of intermediates from batchnorm_forward_fast
+
+  Returns a tuple of:
+  - dx: Gradient with respect to inputs x
+  - dgamma: Gradient with respect to scale parameter gamma, of shape (D,)
+  - dbeta: Gradient with respect to shift parameter beta, of shape (D,)
+  """
+  x_hat, scale = cache
+  M = x_hat.size // scale.size
+  # The normalized axes are those scale is broadcast along; treating a
+  # feature axis of size 1 as one of them gives the same sums
+  axes = tuple(i for i, d in enumerate(scale.shape) if d == 1)
+
+  dbeta = dout.sum(axis=axes)
+  dgamma = _sum_of_products(dout, x_hat, axes)
+
+  dx = x_hat * (dgamma.reshape(scale.shape) / -M)
+  dx -= dbeta.reshape(scale.shape) / M
+  dx += dout
+  dx *= scale
+
+  return dx, dgamma.ravel(), dbeta.ravel()
+
+
+def _sum_of_products(a, b, axes):
+  """
+  Returns np.sum(a * b, axis=axes) without materializing a * b.
+  """
+  letters = 'abcdefghijklmnopqrstuvwxyz'[:a.ndim]
+  kept = ''.join(l for i, l in enumerate(letters) if i not in axes)
+  return np.einsum('%s,%s->%s' % (letters, letters, kept), a, b)
+
+
+def batchnorm_fold(w, b, gamma, beta, bn_param, out=None):
+  """
+  Fold a test-time batch normalization into the affine layer before it:
+  batchnorm(x.dot(w) + b) == x.dot(w_fold) + b_fold, using the running
+  averages of bn_param (with the same defaults as batchnorm_forward_fast).
+
+  Inputs:
+  - w, b: Weights of shape (D, M) and biases of shape (M,) of the affine layer
+  - gamma, beta, bn_param: Parameters of the batchnorm layer
+  - out: Optional array of the shape and dtype of w to write w_fold into
+
+  Returns a tuple of:
+  - w_fold: Weights of shape (D, M)
+  - b_fold: Biases of shape (M,)
+  """
+  eps = bn_param.get('eps', 1e-5)
+  M = w.shape[1]
+  running_mean = bn_param.get('running_mean', np.zeros(M, dtype=w.dtype))
+  running_var = bn_param.get('running_var', np.zeros(M, dtype=w.dtype))
+  scale = (gamma / np.sqrt(running_var + eps)).astype(w.dtype, copy=False)
+  w_fold = np.multiply(w, scale, out=out)
+  b_fold = (b - running_mean) * scale + beta
+  return w_fold, b_fold.astype(w.dtype, copy=False)
+
+
 def dropout_forward(x, dropout_param):
   """
   Performs the forward pass for (inverted) dropout.
@@ -571,6 +719,12 @@ def spatial_batchnorm_forward(x, gamma, beta, bn_param):
       default of momentum=0.9 should work well in most situations.
     - running_mean: Array of shape (D,) giving running mean of features
     - running_var Array of shape (D,) giving running variance of features
+    - layout: 'NCHW' (default) or 'NHWC'. With 'NHWC', x and out have shape
+      (N, H, W, C).
+
+  Both layouts are normalized over the (N, H, W) axes with
+  batchnorm_forward_fast, without transposing the data; x is left unchanged
+  and out is a new array of the same layout.
     
   Returns a tuple of:
   - out: Output data, of shape (N, C, H, W)
@@ -585,9 +739,10 @@ def spatial_batchnorm_forward(x, gamma, beta, bn_param):
   # version of batch normalization defined above. Your implementation should  #
   # be very short; ours is less than five lines.                              #
   #############################################################################
-  N, C, H, W = x.shape
-  temp_output, cache = batchnorm_forward(x.transpose(0,3,2,1).reshape((N*H*W,C)), gamma, beta, bn_param)
-  out = temp_output.reshape(N,W,H,C).transpose(0,3,2,1)
+  if bn_param.get('layout', 'NCHW') == 'NHWC':
+    out, cache = batchnorm_forward_fast(x, gamma, beta, bn_param, axis=(0, 1, 2))
+  else:
+    out, cache = batchnorm_forward_fast(x, gamma, beta, bn_param, axis=(0, 2, 3))
   #pass
   #############################################################################
   #                             END OF YOUR CODE                              #
@@ -618,9 +773,7 @@ def spatial_batchnorm_backward(dout, cache):
   # version of batch normalization defined above. Your implementation should  #
   # be very short; ours is less than five lines.                              #
   #############################################################################
-  N,C,H,W = dout.shape
-  dx_temp, dgamma, dbeta = batchnorm_backward_alt(dout.transpose(0,3,2,1).reshape((N*H*W,C)),cache)
-  dx = dx_temp.reshape(N,W,H,C).transpose(0,3,2,1)
+  dx, dgamma, dbeta = batchnorm_backward_fast(dout, cache)
   #pass
   #############################################################################
   #                             END OF YOUR CODE                              #
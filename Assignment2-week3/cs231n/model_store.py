@@ -0,0 +1,219 @@
+import copy
+import json
+import os
+import pickle
+import shutil
+import time
+
+import numpy as np
+
+"""
+An on-disk store of trained models that can be listed and compared without
+loading their weights.
+
+A store is a directory with a small manifest.json describing every model:
+the shape and dtype of each parameter, how it is stored, the number of
+parameters, the size on disk and any metadata passed to save(), such as the
+validation accuracy. Each model has a subdirectory holding one .npy file per
+parameter, which is memory-mapped when read, and model.pkl, the model object
+with its params removed.
+
+Parameters can be stored as they are, as float16, or as int8 with one scale
+per array (symmetric linear quantization); they are converted back to their
+original dtype when loaded. int8 storage only applies to weight matrices and
+filters: arrays with fewer than two dimensions (biases, batchnorm gamma and
+beta) are small and kept as they are.
+
+Example usage:
+
+store = ModelStore('cs231n/models')
+store.save('fc_net_bn', model, storage='float16', metadata={'val_acc': 0.52})
+for name, info in store.manifest().items():
+  print(name, info['num_params'], info['metadata'].get('val_acc'))
+W1 = store.load_params('fc_net_bn', keys=['W1'])['W1']
+model = store.load('fc_net_bn')
+"""
+
+storage_dtypes = {
+  'float16': np.float16,
+  'int8': np.int8,
+}
+
+
+def quantize(a, storage):
+  """
+  Convert an array for storage.
+
+  Inputs:
+  - a: Array of floating point values
+  - storage: None to store a as it is, or one of the keys of storage_dtypes
+
+  Returns a tuple of:
+  - stored: The array to write to disk
+  - scale: For int8, the float such that a is approximately stored * scale;
+    None otherwise
+  """
+  if storage is None or (storage == 'int8' and a.ndim < 2):
+    return a, None
+  if storage == 'float16':
+    return a.astype(np.float16), None
+  if storage == 'int8':
+    scale = float(np.max(np.abs(a))) / 127 or 1.0
+    stored = np.rint(a / scale).clip(-127, 127).astype(np.int8)
+    return stored, scale
+  raise ValueError('Invalid storage "%s"' % storage)
+
+
+def dequantize(stored, dtype, scale=None):
+  """ Convert an array written by quantize back to dtype. """
+  if scale is not None:
+    out = stored.astype(dtype)
+    out *= scale
+    return out
+  if stored.dtype != dtype:
+    return stored.astype(dtype)
+  return stored
+
+
+class ModelStore(object):
+  """
+  A directory of models with a manifest; see the top of this file.
+  """
+
+  def __init__(self, root):
+    """
+    Open the store in the directory root, creating it if needed.
+    """
+    self.root = root
+    if not os.path.isdir(root):
+      os.makedirs(root)
+    self.manifest_file = os.path.join(root, 'manifest.json')
+
+  def manifest(self):
+    """
+    Returns the manifest: a dictionary mapping each model name to a
+    dictionary with the keys 'class', 'storage', 'params' (mapping each
+    parameter name to its 'shape', 'dtype', 'stored_dtype' and 'scale'),
+    'num_params', 'nbytes', 'created' and 'metadata'. Reading it loads no
+    weights.
+    """
+    if not os.path.exists(self.manifest_file):
+      return {}
+    with open(self.manifest_file, 'r') as f:
+      return json.load(f)['models']
+
+  def _write_manifest(self, models):
+    # Write under a temporary name and rename, so readers never see half of it
+    tmp_file = '%s.tmp%d' % (self.manifest_file, os.getpid())
+    with open(tmp_file, 'w') as f:
+      json.dump({'version': 1, 'models': models}, f, indent=1, sort_keys=True)
+    os.replace(tmp_file, self.manifest_file)
+
+  def names(self):
+    """ Returns the sorted list of the names of the stored models. """
+    return sorted(self.manifest())
+
+  def info(self, name):
+    """ Returns the manifest entry of one model. """
+    models = self.manifest()
+    if name not in models:
+      raise KeyError('No model "%s" in %s' % (name, self.root))
+    return models[name]
+
+  def save(self, name, model, storage=None, metadata=None):
+    """
+    Add a model to the store, replacing any model of the same name.
+
+    Inputs:
+    - name: Name of the model; also the name of its subdirectory
+    - model: A model as described in solver.py, or just a dictionary of
+      params, in which case load() is not available for it
+    - storage: None to store the params in their own dtype, 'float16' or
+      'int8'
+    - metadata: Optional JSON-serializable dictionary kept in the manifest
+    """
+    if storage is not None and storage not in storage_dtypes:
+      raise ValueError('Invalid storage "%s"' % storage)
+    params = model if isinstance(model, dict) else model.params
+    model_dir = os.path.join(self.root, name)
+    tmp_dir = '%s.tmp%d' % (model_dir, os.getpid())
+    if os.path.exists(tmp_dir):
+      shutil.rmtree(tmp_dir)
+    os.makedirs(tmp_dir)
+
+    entry = {'class': None, 'storage': storage, 'params': {},
+             'num_params': 0, 'nbytes': 0, 'created': time.time(),
+             'metadata': metadata or {}}
+    for k, v in params.items():
+      v = np.asarray(v)
+      stored, scale = quantize(v, storage)
+      np.save(os.path.join(tmp_dir, '%s.npy' % k), stored)
+      entry['params'][k] = {'shape': list(v.shape), 'dtype': v.dtype.str,
+                            'stored_dtype': stored.dtype.str, 'scale': scale}
+      entry['num_params'] += int(v.size)
+      entry['nbytes'] += int(stored.nbytes)
+
+    if not isinstance(model, dict):
+      # Pickle the model without its params (and without predict() buffers)
+      skeleton = copy.copy(model)
+      skeleton.params = {}
+      if hasattr(skeleton, '_predict_buffers'):
+        skeleton._predict_buffers = {}
+      with open(os.path.join(tmp_dir, 'model.pkl'), 'wb') as f:
+        pickle.dump(skeleton, f, protocol=pickle.HIGHEST_PROTOCOL)
+      entry['class'] = '%s.%s' % (type(model).__module__,
+                                  type(model).__name__)
+
+    if os.path.exists(model_dir):
+      shutil.rmtree(model_dir)
+    os.replace(tmp_dir, model_dir)
+    models = self.manifest()
+    models[name] = entry
+    self._write_manifest(models)
+
+  def load_params(self, name, keys=None, mmap=True):
+    """
+    Read the params of a model.
+
+    Inputs:
+    - name: Name of the model
+    - keys: Optional list of the params to read; defaults to all of them
+    - mmap: If True, params stored in their own dtype are returned as
+      copy-on-write memory maps, so nothing is read until it is used and
+      changes stay in memory; quantized params are always read and converted.
+
+    Returns:
+    - params: Dictionary mapping parameter names to arrays
+    """
+    entry = self.info(name)
+    if keys is None:
+      keys = list(entry['params'])
+    params = {}
+    for k in keys:
+      spec = entry['params'][k]
+      stored = np.load(os.path.join(self.root, name, '%s.npy' % k),
+                       mmap_mode='c' if mmap else None)
+      params[k] = dequantize(stored, np.dtype(spec['dtype']), spec['scale'])
+    return params
+
+  def load(self, name, mmap=True):
+    """
+    Returns the model saved under name, with its params read by load_params.
+    """
+    model_file = os.path.join(self.root, name, 'model.pkl')
+    if not os.path.exists(model_file):
+      raise ValueError('Model "%s" was saved as a dictionary of params; '
+                       'use load_params' % name)
+    with open(model_file, 'rb') as f:
+      model = pickle.load(f)
+    model.params = self.load_params(name, mmap=mmap)
+    return model
+
+  def remove(self, name):
+    """ Delete a model from the store. """
+    models = self.manifest()
+    models.pop(name, None)
+    self._write_manifest(models)
+    model_dir = os.path.join(self.root, name)
+    if os.path.exists(model_dir):
+      shutil.rmtree(model_dir)
@@ -26,7 +26,9 @@ well; however the default values of the other hyperparameters should work well
 for a variety of different problems.
 
 For efficiency, update rules may perform in-place updates, mutating w and
-setting next_w equal to w.
+setting next_w equal to w. Setting config['in_place'] = True makes
+sgd_momentum, rmsprop and adam do so without allocating any temporaries, by
+delegating to their *_foreach versions below.
 """
 
 
@@ -54,8 +56,11 @@ def sgd_momentum(w, dw, config=None):
     Setting momentum = 0 reduces to sgd.
   - velocity: A numpy array of the same shape as w and dw used to store a moving
     average of the gradients.
+  - in_place: If True, update w and velocity in place.
   """
   if config is None: config = {}
+  if config.get('in_place', False):
+    return sgd_momentum_foreach(w, dw, config)
   config.setdefault('learning_rate', 1e-2)
   config.setdefault('momentum', 0.9)
   v = config.get('velocity', np.zeros_like(w))
@@ -88,8 +93,11 @@ def rmsprop(x, dx, config=None):
     gradient cache.
   - epsilon: Small scalar used for smoothing to avoid dividing by zero.
   - cache: Moving average of second moments of gradients.
+  - in_place: If True, update x and cache in place.
   """
   if config is None: config = {}
+  if config.get('in_place', False):
+    return rmsprop_foreach(x, dx, config)
   config.setdefault('learning_rate', 1e-2)
   config.setdefault('decay_rate', 0.99)
   config.setdefault('epsilon', 1e-8)
@@ -124,8 +132,11 @@ def adam(x, dx, config=None):
   - m: Moving average of gradient.
   - v: Moving average of squared gradient.
   - t: Iteration number.
+  - in_place: If True, update x, m and v in place.
   """
   if config is None: config = {}
+  if config.get('in_place', False):
+    return adam_foreach(x, dx, config)
   config.setdefault('learning_rate', 1e-3)
   config.setdefault('beta1', 0.9)
   config.setdefault('beta2', 0.999)
@@ -157,3 +168,112 @@ def adam(x, dx, config=None):
   
   
 
+
+
+# The *_foreach versions of the update rules below have the same interface,
+# but update w and all the state in config in place, using one scratch buffer
+# of the same shape as w instead of temporaries. They are meant to be called
+# once per step on the flat buffers of flat_params.py, so that every parameter
+# of a model is updated by a handful of vectorized operations; they work just
+# as well on a single parameter array. The results match the rules above.
+
+
+def _scratch(w, config):
+  """ Returns the scratch buffer kept in config, allocating it once. """
+  scratch = config.get('scratch')
+  if scratch is None or scratch.shape != w.shape or scratch.dtype != w.dtype:
+    scratch = config['scratch'] = np.empty_like(w)
+  return scratch
+
+
+def _state(w, config, key):
+  """
+  Returns the optimizer state config[key], initializing it to zeros once;
+  unlike config.setdefault this does not allocate on every call.
+  """
+  if key not in config:
+    config[key] = np.zeros_like(w)
+  return config[key]
+
+
+def sgd_foreach(w, dw, config=None):
+  """
+  In-place version of sgd; config format as for sgd.
+  """
+  if config is None: config = {}
+  config.setdefault('learning_rate', 1e-2)
+
+  step = np.multiply(dw, config['learning_rate'], out=_scratch(w, config))
+  w -= step
+  return w, config
+
+
+def sgd_momentum_foreach(w, dw, config=None):
+  """
+  In-place version of sgd_momentum; config format as for sgd_momentum.
+  """
+  if config is None: config = {}
+  config.setdefault('learning_rate', 1e-2)
+  config.setdefault('momentum', 0.9)
+  v = _state(w, config, 'velocity')
+
+  v *= config['momentum']
+  v -= np.multiply(dw, config['learning_rate'], out=_scratch(w, config))
+  w += v
+  return w, config
+
+
+def rmsprop_foreach(x, dx, config=None):
+  """
+  In-place version of rmsprop; config format as for rmsprop.
+  """
+  if config is None: config = {}
+  config.setdefault('learning_rate', 1e-2)
+  config.setdefault('decay_rate', 0.99)
+  config.setdefault('epsilon', 1e-8)
+  cache = _state(x, config, 'cache')
+  s = _scratch(x, config)
+
+  cache *= config['decay_rate']
+  np.multiply(dx, dx, out=s)
+  s *= 1 - config['decay_rate']
+  cache += s
+  np.sqrt(cache, out=s)
+  s += config['epsilon']
+  np.divide(dx, s, out=s)
+  s *= config['learning_rate']
+  x -= s
+  return x, config
+
+
+def adam_foreach(x, dx, config=None):
+  """
+  In-place version of adam; config format as for adam.
+  """
+  if config is None: config = {}
+  config.setdefault('learning_rate', 1e-3)
+  config.setdefault('beta1', 0.9)
+  config.setdefault('beta2', 0.999)
+  config.setdefault('epsilon', 1e-8)
+  m = _state(x, config, 'm')
+  v = _state(x, config, 'v')
+  config.setdefault('t', 0)
+  beta1, beta2 = config['beta1'], config['beta2']
+  s = _scratch(x, config)
+
+  config['t'] += 1
+  m *= beta1
+  m += np.multiply(dx, 1 - beta1, out=s)
+  v *= beta2
+  np.multiply(dx, dx, out=s)
+  s *= 1 - beta2
+  v += s
+
+  # x -= lr * mb / (sqrt(vb) + eps), with the bias corrections mb and vb
+  np.divide(v, 1 - beta2 ** config['t'], out=s)
+  np.sqrt(s, out=s)
+  s += config['epsilon']
+  np.divide(m, s, out=s)
+  s *= config['learning_rate'] / (1 - beta1 ** config['t'])
+  x -= s
+  return x, config
@@ -0,0 +1,174 @@
+import multiprocessing
+from multiprocessing import shared_memory
+
+import numpy as np
+
+from cs231n.data_iter import normalize_batch
+
+"""
+Test-time predictions of a model spread over a pool of worker processes.
+
+The workers are forked from the training process, so they start with their
+own copy of the model. Its params (and batchnorm running averages) are then
+replaced by views of shared memory blocks, into which the parent copies the
+current values before every evaluation; the data to evaluate and the
+predicted labels are passed through shared memory as well, so nothing but
+the chunk boundaries is pickled.
+"""
+
+# Set in each worker by _init_worker
+_worker = {}
+
+
+def _model_arrays(model):
+  """
+  Returns a dictionary of the arrays a test-time forward pass of model reads
+  and that change during training: model.params, and the running averages
+  of model.bn_params if the model has any.
+  """
+  arrays = {'params/%s' % k: v for k, v in model.params.items()}
+  for i, bn_param in enumerate(getattr(model, 'bn_params', [])):
+    for k in ('running_mean', 'running_var'):
+      if k in bn_param:
+        arrays['bn/%d/%s' % (i, k)] = bn_param[k]
+  return arrays
+
+
+def _attach(name, shape, dtype):
+  """ Map an existing shared memory block as an array. """
+  shm = shared_memory.SharedMemory(name=name)
+  return shm, np.ndarray(shape, dtype=dtype, buffer=shm.buf)
+
+
+def _init_worker(model, specs, compute_dtype, mean):
+  _worker['model'] = model
+  _worker['compute_dtype'] = compute_dtype
+  _worker['mean'] = mean
+  _worker['blocks'] = []
+  for key, (name, shape, dtype) in specs.items():
+    shm, array = _attach(name, shape, dtype)
+    _worker['blocks'].append(shm)
+    kind, _, rest = key.partition('/')
+    if kind == 'params':
+      model.params[rest] = array
+    else:
+      i, _, k = rest.partition('/')
+      model.bn_params[int(i)][k] = array
+
+
+def _predict_into(X, y_pred, start, end, batch_size):
+  model, compute_dtype = _worker['model'], _worker['compute_dtype']
+  mean = _worker['mean']
+  for i in range(start, end, batch_size):
+    X_batch = X[i:min(i + batch_size, end)]
+    if mean is not None:
+      X_batch = normalize_batch(X_batch, mean, compute_dtype or np.float64)
+    elif compute_dtype is not None:
+      X_batch = X_batch.astype(compute_dtype, copy=False)
+    y_pred[i:i + X_batch.shape[0]] = np.argmax(model.loss(X_batch), axis=1)
+
+
+def _predict_chunk(args):
+  """ Predict the labels of X[start:end] into the shared predictions. """
+  (x_name, x_shape, x_dtype), (y_name, y_shape), start, end, batch_size = args
+  x_shm, X = _attach(x_name, x_shape, x_dtype)
+  y_shm, y_pred = _attach(y_name, y_shape, np.intp)
+  _predict_into(X, y_pred, start, end, batch_size)
+  del X, y_pred
+  x_shm.close()
+  y_shm.close()
+
+
+class ParallelEvaluator(object):
+  """
+  Computes model predictions with a pool of forked worker processes.
+
+  Example usage:
+
+  evaluator = ParallelEvaluator(model, num_workers=4)
+  y_pred = evaluator.predict(X_val, batch_size=500)
+  evaluator.close()
+  """
+
+  def __init__(self, model, num_workers, compute_dtype=None, mean=None):
+    """
+    Create the shared memory blocks for the model and start the workers.
+
+    Inputs:
+    - model: A model as described in solver.py; predict() always uses its
+      current params
+    - num_workers: Number of worker processes
+    - compute_dtype: If not None, cast each batch to this dtype first
+    - mean: If not None, X holds raw data and each batch is normalized with
+      data_iter.normalize_batch, to compute_dtype (float64 by default)
+    """
+    self.model = model
+    self.num_workers = num_workers
+    self.compute_dtype = compute_dtype
+    self.mean = mean
+    self.blocks = {}
+    self.pool = None
+    self._start()
+
+  def _start(self):
+    specs = {}
+    for key, v in _model_arrays(self.model).items():
+      shm = shared_memory.SharedMemory(create=True, size=max(v.nbytes, 1))
+      self.blocks[key] = (shm, np.ndarray(v.shape, dtype=v.dtype,
+                                          buffer=shm.buf))
+      specs[key] = (shm.name, v.shape, v.dtype)
+
+    # Fork, so that the workers inherit the model instead of unpickling it
+    context = multiprocessing.get_context('fork')
+    self.pool = context.Pool(self.num_workers, initializer=_init_worker,
+                             initargs=(self.model, specs, self.compute_dtype,
+                                       self.mean))
+
+  def predict(self, X, batch_size=100):
+    """
+    Returns an integer array of shape (N,) with the predicted label of each
+    row of X, computed in batches of batch_size by the workers.
+    """
+    # The arrays may have changed since the workers were started, for
+    # example when the first forward pass creates the batchnorm averages
+    arrays = _model_arrays(self.model)
+    if any(key not in self.blocks or self.blocks[key][1].shape != v.shape
+           or self.blocks[key][1].dtype != v.dtype
+           for key, v in arrays.items()) or len(arrays) != len(self.blocks):
+      self.close()
+      self._start()
+    for key, v in arrays.items():
+      self.blocks[key][1][...] = v
+
+    N = X.shape[0]
+    x_shm = shared_memory.SharedMemory(create=True, size=max(X.nbytes, 1))
+    y_shm = shared_memory.SharedMemory(create=True,
+                                       size=max(N * np.dtype(np.intp).itemsize, 1))
+    try:
+      np.ndarray(X.shape, dtype=X.dtype, buffer=x_shm.buf)[...] = X
+      chunk = -(-N // self.num_workers)
+      chunk = -(-chunk // batch_size) * batch_size
+      tasks = [((x_shm.name, X.shape, X.dtype), (y_shm.name, (N,)),
+                start, min(start + chunk, N), batch_size)
+               for start in range(0, N, chunk)]
+      self.pool.map(_predict_chunk, tasks)
+      y_pred = np.ndarray((N,), dtype=np.intp, buffer=y_shm.buf).copy()
+    finally:
+      x_shm.close()
+      x_shm.unlink()
+      y_shm.close()
+      y_shm.unlink()
+    return y_pred
+
+  def close(self):
+    """ Stop the workers and free the shared memory. """
+    if self.pool is not None:
+      self.pool.terminate()
+      self.pool.join()
+      self.pool = None
+    blocks, self.blocks = self.blocks, {}
+    for key in list(blocks):
+      shm, array = blocks.pop(key)
+      del array
+      shm.close()
+      shm.unlink()
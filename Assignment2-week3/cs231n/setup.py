@@ -1,11 +1,22 @@
+import sys
+
 from distutils.core import setup
 from distutils.extension import Extension
 from Cython.Build import cythonize
 import numpy
 
+# The kernels in im2col_cython.pyx use OpenMP through cython.parallel.prange;
+# the number of threads can be set with the OMP_NUM_THREADS variable.
+if sys.platform == 'win32':
+  openmp_compile_args, openmp_link_args = ['/openmp'], []
+else:
+  openmp_compile_args, openmp_link_args = ['-fopenmp'], ['-fopenmp']
+
 extensions = [
   Extension('im2col_cython', ['im2col_cython.pyx'],
-            include_dirs = [numpy.get_include()]
+            include_dirs = [numpy.get_include()],
+            extra_compile_args = openmp_compile_args,
+            extra_link_args = openmp_link_args,
   ),
 ]
 
@@ -1,6 +1,13 @@
+import os
+import threading
+
 import numpy as np
 
 from cs231n import optim
+from cs231n.data_iter import BatchIterator, PrefetchIterator, normalize_batch
+from cs231n.data_parallel import DataParallel
+from cs231n.flat_params import *
+from cs231n.parallel_eval import ParallelEvaluator
 
 
 class Solver(object):
@@ -71,6 +78,13 @@ class Solver(object):
       names to gradients of the loss with respect to those parameters.
   """
 
+  # Storage and compute dtypes for each precision option
+  precisions = {
+    'float64': (np.float64, np.float64),
+    'float32': (np.float32, np.float32),
+    'float16': (np.float16, np.float32),
+  }
+
   def __init__(self, model, data, **kwargs):
     """
     Construct a new Solver instance.
@@ -82,6 +96,11 @@ class Solver(object):
       'X_val': Array of shape (N_val, d_1, ..., d_k) giving validation images
       'y_train': Array of shape (N_train,) giving labels for training images
       'y_val': Array of shape (N_val,) giving labels for validation images
+      It may also hold a 'mean_image' of shape (d_1, ..., d_k), as returned by
+      get_CIFAR10_data(dtype=np.uint8): then X_train and X_val are raw
+      (typically uint8) data that are kept as they are, and every batch is
+      converted to the compute dtype (float64 by default) with the mean image
+      subtracted as it is drawn.
       
     Optional arguments:
     - update_rule: A string giving the name of an update rule in optim.py.
@@ -99,12 +118,59 @@ class Solver(object):
       iterations.
     - verbose: Boolean; if set to false then no output will be printed during
       training.
+    - precision: None (the default) to train in the dtype of the model, or
+      one of the keys of Solver.precisions: 'float64', 'float32', or
+      'float16' to store the data as float16 and compute in float32. With
+      'float32' and 'float16' the optimizer keeps float64 master weights in
+      optim_configs[p]['master'] and updates them with the float32
+      gradients, so small updates are not lost to rounding. Steps whose loss
+      or gradients are not finite are skipped.
+    - shuffle: How minibatches are sampled from the training data; one of
+      'epoch' (default; a new permutation every epoch), 'once', 'replacement'
+      or 'none', see data_iter.BatchIterator.
+    - drop_last: Boolean; if True, skip the smaller last batch of each epoch.
+    - sampler: Optional custom sampler for BatchIterator; overrides shuffle.
+    - prefetch: Number of minibatches to gather (and cast to the compute
+      dtype of precision) ahead of time in a background thread, overlapping
+      this with the forward and backward passes; 0 (default) disables it.
+      The thread runs during train() only, and the batches are then drawn
+      from a private random number generator seeded from np.random.
+    - checkpoint_name: If not None, then save a snapshot of the training
+      state to the file checkpoint_name + '_epoch_%d.npz' at the end of
+      every checkpoint_every epochs. The files are written by a background
+      thread; pass one to resume() to continue training from it.
+    - checkpoint_every: Number of epochs between checkpoints; default 1.
+    - eval_every: Number of epochs between accuracy checks; default 1. The
+      first and the last iteration are always checked.
+    - num_train_samples: Number of training samples to check the training
+      accuracy on; default 1000, None for all of them, 0 to skip it.
+    - num_val_samples: Number of validation samples to check the validation
+      accuracy on; default None for all of them.
+    - patience: If not None, stop training early once this many accuracy
+      checks in a row did not improve on the best validation accuracy.
+    - best_params_dir: If not None, keep the best params in memory-mapped
+      .npy files in this directory instead of in memory, for models too big
+      to hold twice.
+    - num_workers: Number of worker processes to split every minibatch over,
+      see data_parallel.DataParallel; default 0 computes the loss and
+      gradients in this process. The gradients of the shards are averaged,
+      and so are the batchnorm running averages (the batch statistics of
+      each shard are its own). Like eval_workers this needs a POSIX system.
+    - eval_workers: Number of worker processes to compute the predictions of
+      check_accuracy with, see parallel_eval.ParallelEvaluator; default 0
+      computes them in this process. The workers are forked, so this needs a
+      POSIX system.
+    - eval_batch_size: Batch size of check_accuracy; default 100.
+    - flat_params: Boolean; if True, the arrays of model.params are replaced
+      by views into one contiguous buffer, and each step updates the whole
+      buffer with a single call to the _foreach version of update_rule.
     """
     self.model = model
     self.X_train = data['X_train']
     self.y_train = data['y_train']
     self.X_val = data['X_val']
     self.y_val = data['y_val']
+    self.mean_image = data.get('mean_image')
     
     # Unpack keyword arguments
     self.update_rule = kwargs.pop('update_rule', 'sgd')
@@ -115,6 +181,22 @@ class Solver(object):
 
     self.print_every = kwargs.pop('print_every', 10)
     self.verbose = kwargs.pop('verbose', True)
+    self.precision = kwargs.pop('precision', None)
+    self.flat_params = kwargs.pop('flat_params', False)
+    self.shuffle = kwargs.pop('shuffle', 'epoch')
+    self.drop_last = kwargs.pop('drop_last', False)
+    self.sampler = kwargs.pop('sampler', None)
+    self.prefetch = kwargs.pop('prefetch', 0)
+    self.checkpoint_name = kwargs.pop('checkpoint_name', None)
+    self.checkpoint_every = kwargs.pop('checkpoint_every', 1)
+    self.eval_every = kwargs.pop('eval_every', 1)
+    self.num_train_samples = kwargs.pop('num_train_samples', 1000)
+    self.num_val_samples = kwargs.pop('num_val_samples', None)
+    self.patience = kwargs.pop('patience', None)
+    self.best_params_dir = kwargs.pop('best_params_dir', None)
+    self.num_workers = kwargs.pop('num_workers', 0)
+    self.eval_workers = kwargs.pop('eval_workers', 0)
+    self.eval_batch_size = kwargs.pop('eval_batch_size', 100)
 
     # Throw an error if there are extra keyword arguments
     if len(kwargs) > 0:
@@ -125,8 +207,25 @@ class Solver(object):
     # name with the actual function
     if not hasattr(optim, self.update_rule):
       raise ValueError('Invalid update_rule "%s"' % self.update_rule)
+    if self.flat_params:
+      self.update_rule += '_foreach'
+      if not hasattr(optim, self.update_rule):
+        raise ValueError('Update rule "%s" is missing' % self.update_rule)
     self.update_rule = getattr(optim, self.update_rule)
 
+    # Convert the data to the storage dtype once, rather than every batch;
+    # raw data with a mean image is normalized per batch instead
+    self.compute_dtype = np.dtype(np.float64)
+    if self.precision is not None:
+      if self.precision not in self.precisions:
+        raise ValueError('Invalid precision "%s"' % self.precision)
+      storage_dtype, self.compute_dtype = self.precisions[self.precision]
+      if self.mean_image is None:
+        self.X_train = self.X_train.astype(storage_dtype, copy=False)
+        self.X_val = self.X_val.astype(storage_dtype, copy=False)
+      if hasattr(self.model, 'dtype'):
+        self.model.dtype = self.compute_dtype
+
     self._reset()
 
 
@@ -142,39 +241,110 @@ class Solver(object):
     self.loss_history = []
     self.train_acc_history = []
     self.val_acc_history = []
+    self.skipped_steps = 0
+    self.start_iteration = 0
+    self.evals_since_best = 0
+    self._checkpoint_thread = None
+    self._evaluator = None
+    self._parallel = None
+    if getattr(self, '_prefetcher', None) is not None:
+      self._prefetcher.close()
+    self._prefetcher = None
+
+    # The prefetch thread draws the batches, so it gets its own generator
+    # rather than racing the training thread for np.random
+    self.batch_seed = None
+    if self.prefetch:
+      self.batch_seed = np.random.randint(2 ** 31 - 1)
+    self._make_batches()
+
+    # Keep float64 master weights when computing in lower precision
+    masters = {}
+    if self.precision is not None:
+      for p, w in self.model.params.items():
+        if self.compute_dtype != np.float64:
+          masters[p] = w.astype(np.float64)
+        self.model.params[p] = w.astype(self.compute_dtype)
+
+    # With flat_params the optimizer sees a single parameter 'flat' holding
+    # all of model.params, whose entries become views into it
+    if self.flat_params:
+      self.flat_buffer, views = flatten_params(self.model.params)
+      self.model.params.update(views)
+      self.flat_grad_buffer = np.empty_like(self.flat_buffer)
+      self.flat_grads = flat_views(self.flat_grad_buffer, param_shapes(views))
+      if masters:
+        masters = {'flat': flatten_params(masters)[0]}
+      update_params = ['flat']
+    else:
+      update_params = list(self.model.params)
 
     # Make a deep copy of the optim_config for each parameter
     self.optim_configs = {}
-    for p in self.model.params:
+    for p in update_params:
       d = {k: v for k, v in self.optim_config.items()}
+      if p in masters:
+        d['master'] = masters[p]
       self.optim_configs[p] = d
 
 
+  def _make_batches(self):
+    """ Create the BatchIterator over the training data. """
+    self.batches = BatchIterator((self.X_train, self.y_train), self.batch_size,
+                                 shuffle=self.shuffle, drop_last=self.drop_last,
+                                 sampler=self.sampler, seed=self.batch_seed,
+                                 mean=self.mean_image, dtype=self.compute_dtype)
+
+
   def _step(self):
     """
     Make a single gradient update. This is called by train() and should not
     be called manually.
     """
     # Make a minibatch of training data
-    num_train = self.X_train.shape[0]
-    batch_mask = np.random.choice(num_train, self.batch_size)
-    X_batch = self.X_train[batch_mask]
-    y_batch = self.y_train[batch_mask]
+    if self._prefetcher is not None:
+      X_batch, y_batch = self._prefetcher.next_batch()
+    else:
+      X_batch, y_batch = self.batches.next_batch()
+    if self.precision is not None:
+      X_batch = X_batch.astype(self.compute_dtype, copy=False)
 
     # Compute loss and gradient
-    loss, grads = self.model.loss(X_batch, y_batch) ###################
+    if self._parallel is not None:
+      loss, grads = self._parallel.loss(X_batch, y_batch)
+    else:
+      loss, grads = self.model.loss(X_batch, y_batch)
     self.loss_history.append(loss)
 
+    # Skip steps that overflowed rather than corrupting the weights
+    if self.precision is not None:
+      finite = np.isfinite(loss)
+      finite = finite and all(np.isfinite(g.sum()) for g in grads.values())
+      if not finite:
+        self.skipped_steps += 1
+        return
+
     # Perform a parameter update
-    for p, w in self.model.params.items():
+    params = self.model.params
+    if self.flat_params:
+      flatten_grads(grads, self.flat_grads)
+      params = {'flat': self.flat_buffer}
+      grads = {'flat': self.flat_grad_buffer}
+    for p, w in params.items():
       dw = grads[p]
       config = self.optim_configs[p]
-      next_w, next_config = self.update_rule(w, dw, config)
-      self.model.params[p] = next_w
+      if 'master' in config:
+        master, next_config = self.update_rule(config['master'], dw, config)
+        next_config['master'] = master
+        np.copyto(w, master, casting='same_kind')
+        next_w = w
+      else:
+        next_w, next_config = self.update_rule(w, dw, config)
+      params[p] = next_w
       self.optim_configs[p] = next_config
 
 
-  def check_accuracy(self, X, y, num_samples=None, batch_size=100):
+  def check_accuracy(self, X, y, num_samples=None, batch_size=None):
     """
     Check accuracy of the model on the provided data.
     
@@ -184,7 +354,7 @@ class Solver(object):
     - num_samples: If not None, subsample the data and only test the model
       on num_samples datapoints.
     - batch_size: Split X and y into batches of this size to avoid using too
-      much memory.
+      much memory; defaults to eval_batch_size.
       
     Returns:
     - acc: Scalar giving the fraction of instances that were correctly
@@ -199,68 +369,262 @@ class Solver(object):
       X = X[mask]
       y = y[mask]
 
-    # Compute predictions in batches
-    num_batches = N / batch_size
-    if N % batch_size != 0:
-      num_batches += 1
-    y_pred = []
-    for i in range(int(num_batches)):
-      start = i * batch_size
-      end = (i + 1) * batch_size
-      scores = self.model.loss(X[start:end]) #########################
-      y_pred.append(np.argmax(scores, axis=1))
-    y_pred = np.hstack(y_pred)
+    # Compute predictions in batches, in the worker processes if there are any
+    if batch_size is None:
+      batch_size = self.eval_batch_size
+    if self._evaluator is not None:
+      y_pred = self._evaluator.predict(X, batch_size)
+    elif self.eval_workers > 0:
+      evaluator = self._make_evaluator()
+      try:
+        y_pred = evaluator.predict(X, batch_size)
+      finally:
+        evaluator.close()
+    else:
+      y_pred = np.empty(N, dtype=np.intp)
+      for start in range(0, N, batch_size):
+        X_batch = X[start:start + batch_size]
+        if self.mean_image is not None:
+          X_batch = normalize_batch(X_batch, self.mean_image,
+                                    self.compute_dtype)
+        elif self.precision is not None:
+          X_batch = X_batch.astype(self.compute_dtype, copy=False)
+        scores = self.model.loss(X_batch)
+        y_pred[start:start + X_batch.shape[0]] = np.argmax(scores, axis=1)
     acc = np.mean(y_pred == y)
 
     return acc
 
 
+  def _make_evaluator(self):
+    """ Start a ParallelEvaluator with eval_workers workers for the model. """
+    compute_dtype = self.compute_dtype if self.precision is not None else None
+    if self.mean_image is not None:
+      compute_dtype = self.compute_dtype
+    return ParallelEvaluator(self.model, self.eval_workers, compute_dtype,
+                             mean=self.mean_image)
+
+
   def train(self):
     """
     Run optimization to train the model.
     """
-    num_train = self.X_train.shape[0]
-    iterations_per_epoch = max(num_train / self.batch_size, 1)
+    iterations_per_epoch = max(len(self.batches), 1)
     num_iterations = self.num_epochs * iterations_per_epoch
 
-    for t in range(int(num_iterations)):
-      self._step()
-
-      # Maybe print training loss
-      if self.verbose and t % self.print_every == 0:
-        print('(Iteration %d / %d) loss: %f' % (
-               t + 1, num_iterations, self.loss_history[-1]))
-
-      # At the end of every epoch, increment the epoch counter and decay the
-      # learning rate.
-      epoch_end = (t + 1) % iterations_per_epoch == 0
-      if epoch_end:
-        self.epoch += 1
-        for k in self.optim_configs:
-          self.optim_configs[k]['learning_rate'] *= self.lr_decay
-
-      # Check train and val accuracy on the first iteration, the last
-      # iteration, and at the end of each epoch.
-      first_it = (t == 0)
-      last_it = (t == num_iterations + 1)
-      if first_it or last_it or epoch_end:
-        train_acc = self.check_accuracy(self.X_train, self.y_train,
-                                        num_samples=1000)
-        val_acc = self.check_accuracy(self.X_val, self.y_val)
-        self.train_acc_history.append(train_acc)
-        self.val_acc_history.append(val_acc)
-
-        if self.verbose:
-          print('(Epoch %d / %d) train acc: %f; val_acc: %f' % (
-                 self.epoch, self.num_epochs, train_acc, val_acc))
-
-        # Keep track of the best model
-        if val_acc > self.best_val_acc:
-          self.best_val_acc = val_acc
-          self.best_params = {}
-          for k, v in self.model.params.items():
-            self.best_params[k] = v.copy()
-
-    # At the end of training swap the best params into the model
-    self.model.params = self.best_params
+    # Keep the training and evaluation workers running for the whole of
+    # training
+    try:
+      if self.num_workers > 0:
+        self._parallel = DataParallel(self.model, self.num_workers)
+        self._parallel.step = self.start_iteration
+      if self.eval_workers > 0:
+        self._evaluator = self._make_evaluator()
+      if self.prefetch:
+        # Start from the first batch of the current epoch, which with
+        # batch_seed is the batch a checkpoint of this epoch resumes at
+        self.batches.set_epoch(self.epoch)
+        dtypes = (self.compute_dtype if self.precision else None, None)
+        self._prefetcher = PrefetchIterator(self.batches, self.prefetch, dtypes)
+
+      for t in range(self.start_iteration, int(num_iterations)):
+        self._step()
+
+        # Maybe print training loss
+        if self.verbose and t % self.print_every == 0:
+          print('(Iteration %d / %d) loss: %f' % (
+                 t + 1, num_iterations, self.loss_history[-1]))
+
+        # At the end of every epoch, increment the epoch counter and decay the
+        # learning rate.
+        epoch_end = (t + 1) % iterations_per_epoch == 0
+        if epoch_end:
+          self.epoch += 1
+          for k in self.optim_configs:
+            self.optim_configs[k]['learning_rate'] *= self.lr_decay
+
+        # Check train and val accuracy on the first iteration, the last
+        # iteration, and at the end of every eval_every epochs.
+        first_it = (t == 0)
+        last_it = (t == num_iterations - 1)
+        eval_epoch = epoch_end and self.epoch % self.eval_every == 0
+        stop = False
+        if first_it or last_it or eval_epoch:
+          train_acc = None
+          if self.num_train_samples != 0:
+            train_acc = self.check_accuracy(self.X_train, self.y_train,
+                                            num_samples=self.num_train_samples)
+            self.train_acc_history.append(train_acc)
+          val_acc = self.check_accuracy(self.X_val, self.y_val,
+                                        num_samples=self.num_val_samples)
+          self.val_acc_history.append(val_acc)
+
+          if self.verbose:
+            print('(Epoch %d / %d) train acc: %s; val_acc: %f' % (
+                   self.epoch, self.num_epochs,
+                   '-' if train_acc is None else '%f' % train_acc, val_acc))
+
+          # Keep track of the best model
+          if val_acc > self.best_val_acc:
+            self.best_val_acc = val_acc
+            self._update_best_params()
+            self.evals_since_best = 0
+          else:
+            self.evals_since_best += 1
+            stop = (self.patience is not None
+                    and self.evals_since_best >= self.patience)
+
+        if (epoch_end and self.checkpoint_name is not None
+            and self.epoch % self.checkpoint_every == 0):
+          self._save_checkpoint(t + 1)
+
+        if stop:
+          if self.verbose:
+            print('Stopping early: no improvement in %d checks' % self.patience)
+          break
+    finally:
+      # Stop the workers and the prefetch thread however training ends,
+      # exceptions and KeyboardInterrupt included
+      if self._checkpoint_thread is not None:
+        self._checkpoint_thread.join()
+      if self._evaluator is not None:
+        self._evaluator.close()
+        self._evaluator = None
+      if self._prefetcher is not None:
+        self._prefetcher.close()
+        self._prefetcher = None
+      if self._parallel is not None:
+        self._parallel.close()
+        self._parallel = None
+
+    # At the end of training copy the best params into the model
+    for k, v in self.best_params.items():
+      self.model.params[k][...] = v
+
+
+  def _update_best_params(self, params=None):
+    """
+    Copy params (by default the current model.params) into
+    self.best_params. The arrays for the copies are allocated (or
+    memory-mapped in best_params_dir) on the first call and reused
+    afterwards.
+    """
+    if params is None:
+      params = self.model.params
+    if not self.best_params:
+      for k, v in params.items():
+        if self.best_params_dir is None:
+          self.best_params[k] = np.empty_like(v)
+        else:
+          filename = os.path.join(self.best_params_dir, 'best_%s.npy' % k)
+          self.best_params[k] = np.lib.format.open_memmap(
+              filename, mode='w+', dtype=v.dtype, shape=v.shape)
+    for k, v in params.items():
+      self.best_params[k][...] = v
+
+
+  def _checkpoint_state(self, iteration):
+    """
+    Returns a flat dictionary of arrays describing the training state: the
+    params, the optimizer state, the batchnorm running averages, the best
+    params, the histories, the epoch and iteration counters, the state of
+    the global random number generator and the seed of the batches. Arrays
+    are copied, since training keeps updating them in place.
+    """
+    state = {}
+    for k, v in self.model.params.items():
+      state['params/%s' % k] = np.array(v)
+    for k, v in self.best_params.items():
+      state['best_params/%s' % k] = np.array(v)
+    for p, config in self.optim_configs.items():
+      for k, v in config.items():
+        if k not in ('scratch', 'in_place'):
+          state['optim/%s/%s' % (p, k)] = np.array(v)
+    for i, bn_param in enumerate(getattr(self.model, 'bn_params', [])):
+      for k in ('running_mean', 'running_var'):
+        if k in bn_param:
+          state['bn/%d/%s' % (i, k)] = np.array(bn_param[k])
+
+    state['epoch'] = np.array(self.epoch)
+    state['iteration'] = np.array(iteration)
+    state['best_val_acc'] = np.array(self.best_val_acc)
+    state['evals_since_best'] = np.array(self.evals_since_best)
+    state['loss_history'] = np.array(self.loss_history)
+    state['train_acc_history'] = np.array(self.train_acc_history)
+    state['val_acc_history'] = np.array(self.val_acc_history)
+    if self.batch_seed is not None:
+      state['batch_seed'] = np.array(self.batch_seed)
+
+    _, keys, pos, has_gauss, cached_gaussian = np.random.get_state()
+    state['rng/keys'] = keys
+    state['rng/pos'] = np.array(pos)
+    state['rng/has_gauss'] = np.array(has_gauss)
+    state['rng/cached_gaussian'] = np.array(cached_gaussian)
+    return state
+
+
+  def _save_checkpoint(self, iteration):
+    """
+    Snapshot the training state and write it in a background thread. The
+    file is written under a temporary name and then renamed, so a crash
+    never leaves a truncated checkpoint behind.
+    """
+    state = self._checkpoint_state(iteration)
+    filename = '%s_epoch_%d.npz' % (self.checkpoint_name, self.epoch)
+
+    def write():
+      tmp_filename = filename + '.tmp'
+      with open(tmp_filename, 'wb') as f:
+        np.savez(f, **state)
+      os.replace(tmp_filename, filename)
+      if self.verbose:
+        print('Saved checkpoint to "%s"' % filename)
+
+    # Keep at most one write in flight
+    if self._checkpoint_thread is not None:
+      self._checkpoint_thread.join()
+    self._checkpoint_thread = threading.Thread(target=write)
+    self._checkpoint_thread.start()
+
+
+  def resume(self, path):
+    """
+    Restore the training state from a checkpoint written by train(), so that
+    the next call to train() continues after the checkpointed epoch. The
+    Solver must have been constructed with the same model architecture and
+    options as the one that wrote the checkpoint.
+    """
+    with np.load(path) as f:
+      state = {k: f[k] for k in f.files}
+
+    for k, v in self.model.params.items():
+      v[...] = state['params/%s' % k]
+    best_params = {}
+    for key, v in state.items():
+      kind, _, name = key.partition('/')
+      if kind == 'best_params':
+        best_params[name] = v
+      elif kind == 'optim':
+        p, _, k = name.rpartition('/')
+        self.optim_configs[p][k] = v if v.ndim > 0 else v.item()
+      elif kind == 'bn':
+        i, _, k = name.partition('/')
+        self.model.bn_params[int(i)][k] = v
+    if best_params:
+      self._update_best_params(best_params)
+
+    self.epoch = int(state['epoch'])
+    self.start_iteration = int(state['iteration'])
+    self.best_val_acc = float(state['best_val_acc'])
+    self.evals_since_best = int(state['evals_since_best'])
+    self.loss_history = list(state['loss_history'])
+    self.train_acc_history = list(state['train_acc_history'])
+    self.val_acc_history = list(state['val_acc_history'])
+
+    np.random.set_state(('MT19937', state['rng/keys'], int(state['rng/pos']),
+                         int(state['rng/has_gauss']),
+                         float(state['rng/cached_gaussian'])))
+    if 'batch_seed' in state:
+      self.batch_seed = int(state['batch_seed'])
+      self._make_batches()
 
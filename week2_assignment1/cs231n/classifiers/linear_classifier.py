@@ -1,4 +1,5 @@
 import numpy as np
+from cs231n.data_iter import BatchIterator
 from cs231n.classifiers.linear_svm import *
 from cs231n.classifiers.softmax import *
 
@@ -8,7 +9,7 @@ class LinearClassifier(object):
     self.W = None
 
   def train(self, X, y, learning_rate=1e-3, reg=1e-5, num_iters=100,
-            batch_size=200, verbose=False):
+            batch_size=200, verbose=False, shuffle='epoch'):
     """
     使用随机梯度下降训练这个线性分类器。
 
@@ -21,6 +22,8 @@ class LinearClassifier(object):
         - num_iters: （整数）优化时的迭代步数。
         - batch_size: （整数）每一步使用的训练样本数量。
         - verbose: （布尔值）如果为真，则在优化过程中打印进度。
+        - shuffle: （字符串）小批量的抽样方式，见 data_iter.BatchIterator；
+          默认 'epoch' 每个 epoch 重新打乱一次，'replacement' 为原来的有放回抽样。
 
         输出：
         包含每次训练迭代中损失函数值的列表。
@@ -33,6 +36,7 @@ class LinearClassifier(object):
 
     # 运行随机梯度下降以优化 W
     loss_history = []
+    batches = BatchIterator((X, y), batch_size, shuffle=shuffle)
     for it in range(num_iters):
       X_batch = None
       y_batch = None
@@ -45,9 +49,7 @@ class LinearClassifier(object):
       #                                                                       #
       # 提示：使用 np.random.choice 生成索引。带替换抽样的速度比不带替换抽样要快。   #
       #########################################################################
-      batch_idx = np.random.choice(num_train, batch_size, replace = True)
-      X_batch =  X[batch_idx]
-      y_batch = y[batch_idx]
+      X_batch, y_batch = batches.next_batch()
       #pass
 
 